@@ -4,6 +4,7 @@ import json
 import subprocess
 from picamera2 import Picamera2
 import logging
+import time
 from time import sleep
 
 logging.basicConfig(level=logging.INFO, 
@@ -158,7 +159,8 @@ def main():
         best = max(successful_results, key=lambda x: x["fps"])
         print(f"""
 stream = VideoStream(
-    resolution={best['config']['size']},
+    width={best['config']['size'][0]},
+    height={best['config']['size'][1]},
     framerate={int(best['fps'])},
     format="{best['config']['format']}",
     brightness=0.0,
@@ -166,6 +168,8 @@ stream = VideoStream(
     saturation=1.0
 )
 """)
+        logging.info("For a full search over sensor modes, formats, buffer counts and "
+                     "encoder settings, run: python -m picamera2_webstream.autotune")
     else:
         logging.error("No working configurations found!")
 
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Soak test: stream synthetic frames to several clients for a long run and
+check that resident memory stops growing once the stream is warm.
+
+Frames are generated in pooled arrays, run through the same Pipeline,
+JPEG encoder and web app as the camera stream, and read back over HTTP,
+so no camera is needed:
+
+    python examples/memory_soak.py --seconds 600 --clients 4
+
+Exits with status 1 if RSS grows by more than --max-growth-mb after the
+warm-up period. tests/test_memory.py runs a short version of the same check.
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import urllib.request
+from time import monotonic, sleep
+
+from werkzeug.serving import make_server
+
+# Add the parent directory to sys.path for imports
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+from picamera2_webstream.procstats import read_process_usage
+from picamera2_webstream.relay import read_multipart
+from picamera2_webstream.stream_picamera import create_app
+from picamera2_webstream.synthetic import SyntheticStream
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+
+def read_stream(url, stop_event, counts, index):
+    """Read a /video_feed like a browser until told to stop"""
+    with urllib.request.urlopen(url, timeout=10) as response:
+        for _ in read_multipart(response):
+            counts[index] += 1
+            if stop_event.is_set():
+                break
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check memory stays bounded while streaming")
+    parser.add_argument('--seconds', type=float, default=300, help="Length of the run")
+    parser.add_argument('--warmup', type=float, default=30,
+                        help="Seconds before the RSS baseline is taken")
+    parser.add_argument('--clients', type=int, default=3, help="Concurrent /video_feed readers")
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--framerate', type=int, default=30)
+    parser.add_argument('--max-growth-mb', type=float, default=8.0,
+                        help="Allowed RSS growth after warm-up")
+    parser.add_argument('--port', type=int, default=8099)
+    args = parser.parse_args()
+
+    stream = SyntheticStream(args.width, args.height, args.framerate).start()
+    server = make_server('127.0.0.1', args.port, create_app(stream, "Memory soak"), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    stop_event = threading.Event()
+    counts = [0] * args.clients
+    readers = [threading.Thread(target=read_stream, daemon=True,
+                                args=(f"http://127.0.0.1:{args.port}/video_feed",
+                                      stop_event, counts, i))
+               for i in range(args.clients)]
+    for reader in readers:
+        reader.start()
+
+    pid = os.getpid()
+    started = monotonic()
+    baseline = None
+    peak = 0
+    while monotonic() - started < args.seconds:
+        sleep(5)
+        _, rss = read_process_usage(pid)
+        elapsed = monotonic() - started
+        if baseline is None and elapsed >= args.warmup:
+            baseline = rss
+        elif baseline is not None:
+            peak = max(peak, rss)
+        logging.info(f"{elapsed:.0f}s: RSS {rss / 2**20:.1f} MB, frames {stream.frame_seq}, "
+                     f"delivered {sum(counts)}, pool {stream.frame_pool.as_dict()}")
+
+    stop_event.set()
+    server.shutdown()
+    stream.stop()
+
+    if baseline is None:
+        logging.error("Run was shorter than the warm-up; no baseline taken")
+        return 1
+    growth = (max(peak, baseline) - baseline) / 2**20
+    if growth > args.max_growth_mb:
+        logging.error(f"RSS grew by {growth:.1f} MB after warm-up "
+                      f"(limit {args.max_growth_mb} MB)")
+        return 1
+    logging.info(f"RSS grew by {growth:.1f} MB after warm-up; memory is bounded")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+import logging
+import os
+from picamera2_webstream.stream_picamera import VideoStream, create_app
+from picamera2_webstream.workers import serve_workers
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+
+def build_app(stream):
+    """Flask app for each HTTP worker; must be module-level so workers can import it"""
+    return create_app(stream, title="Pi Camera Stream")
+
+
+if __name__ == '__main__':
+    stream = None
+    try:
+        # This process captures and encodes; the workers only serve
+        stream = VideoStream(width=1280, height=720, framerate=30).start()
+
+        # One worker per core, all listening on port 8080
+        serve_workers(stream, port=8080, workers=os.cpu_count(), app_factory=build_app)
+    except Exception as e:
+        logging.error(f"Server error: {str(e)}")
+    finally:
+        if stream: stream.stop()
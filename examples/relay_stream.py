@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+import logging
+import signal
+import sys
+from picamera2_webstream.relay import RelayStream
+from picamera2_webstream.stream_picamera import create_app
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+def signal_handler(signum, frame):
+    """Handle shutdown gracefully"""
+    logging.info("Shutdown signal received")
+    stream.stop()
+    exit(0)
+
+if __name__ == '__main__':
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    # The upstream can be the Pi itself or another relay
+    upstream = sys.argv[1] if len(sys.argv) > 1 else 'http://raspberrypi.local:8080/video_feed'
+
+    stream = None
+    try:
+        stream = RelayStream(upstream, framerate=30).start()
+
+        app = create_app(stream)
+
+        app.run(
+            host='0.0.0.0',
+            port=8080,
+            threaded=True
+        )
+    except Exception as e:
+        logging.error(f"Server error: {str(e)}")
+    finally:
+        if stream: stream.stop()
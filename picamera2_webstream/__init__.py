@@ -1,6 +1,16 @@
 from .stream_picamera import VideoStream, create_app
 from .camera_utils import get_camera_index, find_arducam, list_available_cameras
+from .frame_bus import FrameBusReader
+from .relay import RelayStream
+from .admission import AdmissionControl
+from .overlay import TextOverlay
+from .pipeline import Frame, Pipeline, Stage
+from .trace import Tracer
+from .workers import serve_workers
 #from .stream_ffmpeg import VideoStream, create_app as create_ffmpeg_app
 
 __version__ = '0.2.8'
-__all__ = ['VideoStream', 'create_app', 'get_camera_index', 'find_arducam', 'list_available_cameras']
+__all__ = ['VideoStream', 'create_app', 'get_camera_index', 'find_arducam', 'list_available_cameras',
+           'FrameBusReader', 'RelayStream', 'AdmissionControl',
+           'TextOverlay', 'Frame', 'Pipeline', 'Stage',
+           'Tracer', 'serve_workers']
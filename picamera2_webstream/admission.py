@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+import ipaddress
+import logging
+import os
+import threading
+
+# Niceness of the thread serving each priority class. The capture thread
+# keeps the process default, so under CPU overload it runs first.
+PRIORITY_NICE = {'high': 0, 'normal': 5, 'low': 10}
+
+
+def lower_thread_priority(priority):
+    """Renice the calling thread for a priority class; only ever lowers priority"""
+    nice = PRIORITY_NICE.get(priority, 0)
+    if not nice:
+        return
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), nice)
+    except (AttributeError, OSError) as e:
+        logging.debug(f"Could not set thread priority: {e}")
+
+
+class AdmissionControl:
+    """
+    Limits on concurrent /video_feed streams.
+
+    ``max_clients`` caps streams in total and ``max_per_ip`` per source
+    address; None disables a limit. Clients whose address falls in one of
+    the ``priorities`` networks get that class instead of ``default``:
+
+        AdmissionControl(max_clients=10, max_per_ip=2,
+                         priorities={'high': ['192.168.1.10/32'], 'low': ['0.0.0.0/0']})
+
+    High-priority clients ignore the per-IP limit and may use
+    ``high_reserve`` slots beyond ``max_clients``, so operators can always
+    get in. Rejected clients are told to retry after ``retry_after`` seconds.
+    """
+
+    def __init__(self, max_clients=None, max_per_ip=None, retry_after=5,
+                 priorities=None, default='normal', high_reserve=2):
+        for priority in list(priorities or {}) + [default]:
+            if priority not in PRIORITY_NICE:
+                raise ValueError(f"Unknown priority class '{priority}'")
+        self.max_clients = max_clients
+        self.max_per_ip = max_per_ip
+        self.retry_after = retry_after
+        self.default = default
+        self.high_reserve = high_reserve
+        # Most specific network first, so a /32 wins over a /0
+        self.networks = sorted(((ipaddress.ip_network(network), priority)
+                                for priority, networks in (priorities or {}).items()
+                                for network in networks),
+                               key=lambda item: item[0].prefixlen, reverse=True)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.per_ip = {}
+        self.admitted = {priority: 0 for priority in PRIORITY_NICE}
+        self.rejected = 0
+
+    def classify(self, address):
+        """Priority class for a client address"""
+        try:
+            ip = ipaddress.ip_address(address)
+        except (TypeError, ValueError):
+            return self.default
+        for network, priority in self.networks:
+            if ip.version == network.version and ip in network:
+                return priority
+        return self.default
+
+    def admit(self, address):
+        """Reserve a stream for ``address``; return its priority class, or None if refused"""
+        priority = self.classify(address)
+        with self.lock:
+            limit = self.max_clients
+            if limit is not None and priority == 'high':
+                limit += self.high_reserve
+            over_ip = self.max_per_ip is not None and priority != 'high' and \
+                self.per_ip.get(address, 0) >= self.max_per_ip
+            if over_ip or (limit is not None and self.active >= limit):
+                self.rejected += 1
+                logging.warning(f"Refused stream for {address}: "
+                                f"{'per-IP' if over_ip else 'global'} limit reached")
+                return None
+            self.active += 1
+            self.per_ip[address] = self.per_ip.get(address, 0) + 1
+            self.admitted[priority] += 1
+            return priority
+
+    def release(self, address):
+        """Free the stream reserved by ``admit``"""
+        with self.lock:
+            self.active -= 1
+            self.per_ip[address] -= 1
+            if self.per_ip[address] <= 0:
+                del self.per_ip[address]
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'max_clients': self.max_clients,
+                'max_per_ip': self.max_per_ip,
+                'active': self.active,
+                'addresses': len(self.per_ip),
+                'admitted': dict(self.admitted),
+                'rejected': self.rejected,
+            }
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Benchmark camera configurations and save the fastest as a tuned profile.
+
+Runs the real capture pipeline with each candidate setting on the attached
+camera, one stage at a time: sensor mode, pixel format and encode workers,
+buffer_count, then JPEG quality for raw formats. Each stage keeps the best
+setting found so far and varies one thing. A candidate is scored by its
+sustained frame rate (capped at the target), and among candidates within 5%
+of the best rate the one using the least CPU wins. The result is written to
+tuned_profile.json, which VideoStream loads at startup:
+
+    python -m picamera2_webstream.autotune --size 1280x720 --framerate 30
+
+Stop any running stream service first; the camera can only be opened once.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+from time import monotonic, process_time, sleep, time
+
+from .camera_utils import TUNED_PROFILE_PATH, get_camera_index
+from .jpeg import encode_jpeg
+from .pipeline import Stage
+from .procstats import read_process_usage
+from .stream_picamera import Picamera2, VideoStream
+
+# Candidates within this fraction of the best frame rate count as equally fast
+FPS_TOLERANCE = 0.05
+
+
+def parse_size(text):
+    """Parse a WIDTHxHEIGHT string"""
+    try:
+        width, height = (int(v) for v in text.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"size must be WIDTHxHEIGHT, got '{text}'")
+    return width, height
+
+
+def encode_time(frame, pixel_format, quality, repeats=10):
+    """Mean milliseconds to JPEG-encode one raw frame, as the stream encodes it"""
+    started = monotonic()
+    for _ in range(repeats):
+        encode_jpeg(frame, pixel_format, quality)
+    return (monotonic() - started) * 1000 / repeats
+
+
+def benchmark(settings, framerate=30, seconds=5.0, warmup=1.5, camera_index=None):
+    """
+    Stream with ``settings`` and measure what it sustains.
+
+    Returns a dict with the measured ``fps``, ``cpu_percent`` (of one core,
+    including encode workers) and ``encode_ms`` for one frame in the
+    stream's raw format and quality, or ``error`` if the configuration
+    failed. ``encode_ms`` is None for MJPEG, which the camera encodes.
+    """
+    result = {'settings': dict(settings), 'fps': 0.0, 'cpu_percent': None,
+              'encode_ms': None, 'error': None}
+    stream = None
+    sample = []
+
+    def keep_sample(frame):
+        if frame.array is not None and not sample:
+            sample.append(frame.array.copy())
+
+    try:
+        stream = VideoStream(framerate=framerate, camera_index=camera_index,
+                             watchdog_timeout=0, tuned_profile=False,
+                             stages=[Stage('autotune_sample', keep_sample, tap=True)], **settings)
+        if stream.start() is None:
+            raise RuntimeError("stream failed to start")
+        # A registered client keeps the capture loop running at full rate
+        client = stream.add_client('autotune')
+        sleep(warmup)
+
+        pids = [worker.pid for worker in stream.encode_pool.workers] \
+            if stream.encode_pool is not None else []
+        worker_cpu = sum(read_process_usage(pid)[0] for pid in pids)
+        seq, cpu, started = stream.frame_seq, process_time(), monotonic()
+        sleep(seconds)
+        elapsed = monotonic() - started
+        frames = stream.frame_seq - seq
+        cpu = process_time() - cpu + sum(read_process_usage(pid)[0] for pid in pids) - worker_cpu
+
+        result['fps'] = round(frames / elapsed, 2)
+        result['cpu_percent'] = round(100 * cpu / elapsed, 1)
+        if sample:
+            result['encode_ms'] = round(encode_time(sample[0], stream.format,
+                                                    stream.encode_quality), 2)
+        stream.remove_client(client)
+    except Exception as e:
+        result['error'] = str(e)
+    finally:
+        if stream is not None:
+            stream.stop()
+            if stream.picam2 is not None:
+                try:
+                    stream.picam2.close()
+                except Exception as e:
+                    logging.warning(f"Error closing camera: {e}")
+        # Give libcamera time to release the camera before the next run
+        sleep(0.5)
+
+    if result['error']:
+        logging.warning(f"{settings}: failed ({result['error']})")
+    else:
+        encode = f", {result['encode_ms']} ms/encode" if result['encode_ms'] is not None else ""
+        logging.info(f"{settings}: {result['fps']} fps, {result['cpu_percent']}% CPU{encode}")
+    return result
+
+
+def best_result(results, framerate):
+    """Pick the fastest result, preferring lower CPU among near-equal rates"""
+    working = [r for r in results if not r['error'] and r['fps'] > 0]
+    if not working:
+        return None
+    top = max(min(r['fps'], framerate) for r in working)
+    contenders = [r for r in working if min(r['fps'], framerate) >= top * (1 - FPS_TOLERANCE)]
+    return min(contenders, key=lambda r: r['cpu_percent'])
+
+
+def sensor_mode_candidates(size, camera_index=None):
+    """Indices of the sensor modes at least as large as the output size"""
+    picam2 = Picamera2(camera_index)
+    try:
+        modes = picam2.sensor_modes
+    finally:
+        picam2.close()
+    return [i for i, mode in enumerate(modes)
+            if mode['size'][0] >= size[0] and mode['size'][1] >= size[1]]
+
+
+def autotune(size=(1280, 720), framerate=30, seconds=5.0, camera_index=None,
+             workers=(0, 2, 3), buffer_counts=(2, 3, 4, 6), qualities=(85, 75)):
+    """
+    Run the staged search and return the profile to save.
+
+    Every stage starts from the best settings of the previous stage, so the
+    number of runs grows with the sum rather than the product of the options.
+    """
+    if camera_index is None:
+        camera_index = get_camera_index()
+    best_settings = {'width': size[0], 'height': size[1], 'format': 'YUV420',
+                     'buffer_count': 4, 'encode_workers': 0, 'encode_quality': qualities[0]}
+    results = []
+
+    def run_stage(name, variants):
+        nonlocal best_settings
+        logging.info(f"Tuning {name}")
+        stage = [benchmark({**best_settings, **variant}, framerate, seconds,
+                           camera_index=camera_index) for variant in variants]
+        results.extend(stage)
+        best = best_result(stage, framerate)
+        if best is not None:
+            best_settings = best['settings']
+
+    # Automatic and libcamera's choice first, so a camera without usable
+    # modes still gets a baseline
+    run_stage('sensor mode', [{}, {'sensor_mode': False}] +
+              [{'sensor_mode': i} for i in sensor_mode_candidates(size, camera_index)])
+    # Raw formats with no workers are encoded inline with libjpeg-turbo
+    run_stage('format and encoding', [{'format': 'MJPEG', 'encode_workers': 0}] +
+              [{'format': fmt, 'encode_workers': n}
+               for fmt in ('YUV420', 'RGB888') for n in workers])
+    run_stage('buffer count', [{'buffer_count': n} for n in buffer_counts])
+    # Quality applies wherever we encode; with MJPEG the camera does
+    if best_settings['format'] != 'MJPEG':
+        run_stage('JPEG quality', [{'encode_quality': q} for q in qualities])
+
+    best = best_result(results, framerate)
+    if best is None:
+        raise RuntimeError("No camera configuration worked")
+    return {
+        'created': time(),
+        'target_fps': framerate,
+        'settings': best['settings'],
+        'measured': {key: best[key] for key in ('fps', 'cpu_percent', 'encode_ms')},
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the fastest camera configuration")
+    parser.add_argument('--size', type=parse_size, default=(1280, 720),
+                        help="Output resolution as WIDTHxHEIGHT")
+    parser.add_argument('--framerate', type=int, default=30, help="Target frame rate")
+    parser.add_argument('--seconds', type=float, default=5.0,
+                        help="Measurement time per candidate")
+    parser.add_argument('--camera-index', type=int, default=None, help="Camera to tune")
+    parser.add_argument('--output', default=TUNED_PROFILE_PATH, help="Where to write the profile")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    # Per-candidate stream logs would bury the results
+    logging.getLogger('picamera2').setLevel(logging.WARNING)
+
+    if Picamera2 is None:
+        logging.error("Autotuning needs picamera2")
+        sys.exit(1)
+
+    try:
+        profile = autotune(args.size, args.framerate, args.seconds, args.camera_index)
+    except Exception as e:
+        logging.error(f"Autotuning failed: {e}")
+        sys.exit(1)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(profile, f, indent=2)
+
+    measured = profile['measured']
+    print(f"Best settings: {profile['settings']}")
+    encode = f"{measured['encode_ms']} ms per JPEG encode" \
+        if measured['encode_ms'] is not None else "JPEG encoded by the camera"
+    print(f"Sustained {measured['fps']} fps at {measured['cpu_percent']}% CPU, {encode}")
+    print(f"Profile written to {args.output}; VideoStream will load it at startup")
+
+
+if __name__ == '__main__':
+    main()
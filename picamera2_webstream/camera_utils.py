@@ -107,18 +107,21 @@ def get_v4l2_devices() -> List[Dict]:
         logger.error(f"Unexpected error: {e}")
         return []
 
-def find_camera_by_usb_id(vendor_id: str, product_id: str) -> Optional[str]:
+def find_camera_by_usb_id(vendor_id: str, product_id: str,
+                          devices: Optional[List[Dict]] = None) -> Optional[str]:
     """
     Find a camera device by its USB vendor and product ID.
     
     Args:
         vendor_id: USB vendor ID (e.g., '0c45')
         product_id: USB product ID (e.g., '636d')
+        devices: Result of get_v4l2_devices() to reuse instead of probing again
         
     Returns:
         Path to the camera device or None if not found
     """
-    devices = get_v4l2_devices()
+    if devices is None:
+        devices = get_v4l2_devices()
     
     for device in devices:
         usb_info = device.get('usb_info', {})
@@ -129,17 +132,20 @@ def find_camera_by_usb_id(vendor_id: str, product_id: str) -> Optional[str]:
     
     return None
 
-def find_camera_by_name(name_pattern: str) -> Optional[str]:
+def find_camera_by_name(name_pattern: str,
+                        devices: Optional[List[Dict]] = None) -> Optional[str]:
     """
     Find a camera device by its name using a pattern match.
     
     Args:
         name_pattern: String pattern to match in device name
+        devices: Result of get_v4l2_devices() to reuse instead of probing again
         
     Returns:
         Path to the camera device or None if not found
     """
-    devices = get_v4l2_devices()
+    if devices is None:
+        devices = get_v4l2_devices()
     
     for device in devices:
         if name_pattern.lower() in device['name'].lower():
@@ -147,25 +153,34 @@ def find_camera_by_name(name_pattern: str) -> Optional[str]:
     
     return None
 
-def find_arducam() -> Optional[str]:
+def find_arducam(devices: Optional[List[Dict]] = None) -> Optional[str]:
     """
     Find the Arducam device specifically.
     
+    Args:
+        devices: Result of get_v4l2_devices() to reuse instead of probing again
+        
     Returns:
         Path to the Arducam device or None if not found
     """
+    # Enumerate once for both lookups; every probe runs several v4l2-ctl calls
+    if devices is None:
+        devices = get_v4l2_devices()
+
     # First try by USB ID (Arducam 12MP is 0c45:636d)
-    device = find_camera_by_usb_id('0c45', '636d')
+    device = find_camera_by_usb_id('0c45', '636d', devices)
     if device:
         return device
     
     # Try by name
-    device = find_camera_by_name('Arducam')
+    device = find_camera_by_name('Arducam', devices)
     if device:
         return device
     
     return None
 
+_camera_index = None
+
 def get_camera_index() -> int:
     """
     Get the camera index to use with Picamera2.
@@ -174,9 +189,20 @@ def get_camera_index() -> int:
     1. Config file settings (if present)
     2. USB camera ID or name pattern matching
 
+    The result is cached, so later calls in the same process do not probe
+    the devices again.
+
     Returns:
         Camera index (0, 1, 2, etc.) or 0 if not found
     """
+    global _camera_index
+    if _camera_index is None:
+        _camera_index = _find_camera_index()
+    return _camera_index
+
+def _find_camera_index() -> int:
+    """Probe config and devices for the camera index; see get_camera_index()"""
+    devices = None
     # Try to read from config file
     try:
         import configparser
@@ -203,7 +229,8 @@ def get_camera_index() -> int:
                 if ':' in usb_id:
                     vendor_id, product_id = usb_id.split(':')
                     logger.info(f"Looking for USB camera with ID {vendor_id}:{product_id}")
-                    camera_path = find_camera_by_usb_id(vendor_id, product_id)
+                    devices = get_v4l2_devices()
+                    camera_path = find_camera_by_usb_id(vendor_id, product_id, devices)
                     if camera_path:
                         match = re.search(r'/dev/video(\d+)', camera_path)
                         if match:
@@ -214,7 +241,7 @@ def get_camera_index() -> int:
         logger.warning(f"Error reading config file: {e}")
 
     # Fall back to finding Arducam
-    camera_path = find_arducam()
+    camera_path = find_arducam(devices)
 
     if not camera_path:
         logger.warning("Could not find specific camera. Using default camera index 0.")
@@ -230,6 +257,133 @@ def get_camera_index() -> int:
     logger.warning(f"Could not determine index from path {camera_path}. Using default index 0.")
     return 0
 
+def get_camera_roi() -> Optional[str]:
+    """
+    Get the persistent region of interest for the camera from config.ini.
+
+    Returns:
+        The ``roi`` setting as an "x,y,w,h" string of frame fractions,
+        or None if it is not configured
+    """
+    try:
+        import configparser
+
+        config = configparser.ConfigParser()
+        config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config.ini')
+
+        if os.path.exists(config_path):
+            config.read(config_path)
+            if 'camera' in config and 'roi' in config['camera']:
+                roi = config['camera']['roi'].strip()
+                logger.info(f"Using camera ROI {roi} from config file")
+                return roi
+    except Exception as e:
+        logger.warning(f"Error reading config file: {e}")
+
+    return None
+
+def get_privacy_masks() -> Optional[List[str]]:
+    """
+    Get the privacy mask polygons for the camera from config.ini.
+
+    Returns:
+        The ``privacy_masks`` setting split on ";" into "x,y x,y x,y ..."
+        polygons of frame fractions, or None if it is not configured
+    """
+    try:
+        import configparser
+
+        config = configparser.ConfigParser()
+        config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config.ini')
+
+        if os.path.exists(config_path):
+            config.read(config_path)
+            if 'camera' in config and 'privacy_masks' in config['camera']:
+                masks = [m.strip() for m in config['camera']['privacy_masks'].split(';') if m.strip()]
+                logger.info(f"Using {len(masks)} privacy masks from config file")
+                return masks
+    except Exception as e:
+        logger.warning(f"Error reading config file: {e}")
+
+    return None
+
+# Written by ``python -m picamera2_webstream.autotune``, next to config.ini
+TUNED_PROFILE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'tuned_profile.json')
+
+# Profile keys that are passed on to VideoStream
+TUNED_SETTINGS = ('width', 'height', 'format', 'sensor_mode', 'buffer_count',
+                  'encode_workers', 'encode_quality')
+
+def load_tuned_profile(path: Optional[str] = None) -> Optional[Dict]:
+    """
+    Load the stream settings chosen by the autotuner.
+
+    Args:
+        path: Profile to read, defaults to TUNED_PROFILE_PATH
+
+    Returns:
+        The tuned VideoStream settings, or None if there is no usable profile
+    """
+    import json
+
+    path = path or TUNED_PROFILE_PATH
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            profile = json.load(f)
+        settings = {key: profile['settings'][key] for key in TUNED_SETTINGS
+                    if key in profile['settings']}
+        logger.info(f"Using tuned profile {path}: {settings}")
+        return settings
+    except Exception as e:
+        logger.warning(f"Error reading tuned profile {path}: {e}")
+        return None
+
+# A mode this close to the requested frame rate counts as fast enough
+SENSOR_FPS_TOLERANCE = 0.02
+
+def select_sensor_mode(modes: List[Dict], size: Tuple[int, int],
+                       framerate: float) -> Optional[int]:
+    """
+    Choose the sensor mode best suited to streaming ``size`` at ``framerate``.
+
+    Modes are ranked by, in order: reaching the frame rate, being at least
+    as large as the output so the ISP only downscales, the widest field of
+    view, and then the smallest size, since a binned mode saves CSI
+    bandwidth and ISP time. Among modes too slow for the frame rate the
+    fastest wins.
+
+    Args:
+        modes: ``picam2.sensor_modes``
+        size: Output (width, height)
+        framerate: Requested frames per second
+
+    Returns:
+        Index of the chosen mode, or None if there are no modes
+    """
+    if not modes:
+        return None
+
+    def field_of_view(mode):
+        crop = mode.get('crop_limits')
+        return crop[2] * crop[3] if crop else None
+
+    widest = max(field_of_view(mode) or 0 for mode in modes)
+
+    def rank(index):
+        mode = modes[index]
+        width, height = mode['size']
+        fps = mode.get('fps', 0)
+        covers = width >= size[0] and height >= size[1]
+        view = field_of_view(mode)
+        coverage = round(view / widest, 2) if view and widest else 1.0
+        area = width * height
+        return (fps < framerate * (1 - SENSOR_FPS_TOLERANCE), not covers, -coverage,
+                area if covers else -area, -fps)
+
+    return min(range(len(modes)), key=rank)
+
 def list_available_cameras() -> None:
     """
     List all available camera devices with their information.
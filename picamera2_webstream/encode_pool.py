@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from multiprocessing import shared_memory
+from time import monotonic
+
+import numpy as np
+
+from .jpeg import JPEG_BACKEND, encode_jpeg
+
+
+def _encode_worker(shm_name, shape, dtype, slots, pixel_format, quality, tasks, results):
+    """
+    Worker process: encode raw frames from the shared-memory ring to JPEG.
+
+    Receives ``(seq, slot)`` tasks and sends back ``(seq, slot, jpeg_bytes,
+    span)``. ``jpeg_bytes`` is None if the frame could not be encoded;
+    ``span`` is ``(pid, started, finished)`` of the encode, for tracing.
+    """
+    pid = os.getpid()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    ring = np.ndarray((slots,) + tuple(shape), dtype=dtype, buffer=shm.buf)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            seq, slot = task
+            started = monotonic()
+            try:
+                jpeg_data = encode_jpeg(ring[slot], pixel_format, quality)
+            except Exception as e:
+                logging.error(f"Encode worker failed on frame {seq}: {e}")
+                jpeg_data = None
+            results.put((seq, slot, jpeg_data, (pid, started, monotonic())))
+    finally:
+        del ring
+        shm.close()
+
+
+class EncodePool:
+    """
+    Encode raw camera frames to JPEG on a pool of worker processes.
+
+    Frames are copied into a ring of shared-memory slots so only the slot
+    index crosses the process boundary. The ring size bounds the number of
+    frames in flight: ``submit`` waits for a free slot. Encoded frames are
+    handed to ``on_frame(seq, jpeg_data, timestamp)`` strictly in submission
+    order. With a ``tracer``, each encode is recorded as a span on its
+    worker's track.
+
+    A worker that dies, e.g. killed by the OOM killer, takes its frame with
+    it, and later frames wait behind that one forever. Check ``alive`` and
+    replace the pool when it is False.
+    """
+
+    def __init__(self, shape, dtype=np.uint8, workers=3, slots=None,
+                 pixel_format="RGB888", quality=85, on_frame=None, tracer=None):
+        self.shape = tuple(shape)
+        self.tracer = tracer
+        self.dtype = np.dtype(dtype)
+        self.slots = slots or workers * 2
+        self.on_frame = on_frame
+        self.next_seq = 0
+        self.dropped = 0
+        # Held while a frame is copied into the ring, so close() cannot
+        # unmap it under a capture thread that is still submitting
+        self.lock = threading.Lock()
+        self.closed = False
+
+        slot_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(create=True, size=slot_bytes * self.slots)
+        self.ring = np.ndarray((self.slots,) + self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+        self.timestamps = [None] * self.slots
+        self.free_slots = queue.Queue()
+        for slot in range(self.slots):
+            self.free_slots.put(slot)
+
+        # Spawn rather than fork: the parent holds camera and HTTP threads
+        ctx = multiprocessing.get_context("spawn")
+        self.tasks = ctx.Queue()
+        self.results = ctx.Queue()
+        self.workers = [
+            ctx.Process(target=_encode_worker,
+                        args=(self.shm.name, self.shape, self.dtype.str, self.slots,
+                              pixel_format, quality, self.tasks, self.results),
+                        daemon=True,
+                        name=f"EncodeWorker-{i}")
+            for i in range(workers)
+        ]
+        try:
+            for worker in self.workers:
+                worker.start()
+        except Exception:
+            # Nothing else will ever close a pool that failed to start
+            for worker in self.workers:
+                if worker.pid is not None:
+                    worker.terminate()
+            del self.ring
+            self.shm.close()
+            self.shm.unlink()
+            raise
+
+        self.collector = threading.Thread(target=self._collect,
+                                          daemon=True,
+                                          name="EncodeCollector")
+        self.collector.start()
+        logging.info(f"Encode pool started: {workers} workers, {self.slots} slots "
+                     f"of {slot_bytes} bytes, {JPEG_BACKEND} encoder")
+
+    def submit(self, frame, timestamp=None, timeout=None):
+        """
+        Copy a raw frame into the ring and queue it for encoding.
+
+        Blocks until a slot is free, or up to ``timeout`` seconds. Returns
+        the frame's sequence number, or None if no slot became free.
+        """
+        try:
+            slot = self.free_slots.get(timeout=timeout)
+        except queue.Empty:
+            self.dropped += 1
+            return None
+        with self.lock:
+            if self.closed:
+                return None
+            np.copyto(self.ring[slot], frame)
+            self.timestamps[slot] = timestamp
+            seq = self.next_seq
+            self.next_seq += 1
+            self.tasks.put((seq, slot))
+        return seq
+
+    @property
+    def alive(self):
+        """Whether every worker is still running"""
+        return all(worker.is_alive() for worker in self.workers)
+
+    @property
+    def in_flight(self):
+        return self.slots - self.free_slots.qsize()
+
+    def _collect(self):
+        """Reorder encoded frames by sequence number and release their slots"""
+        pending = {}
+        expected = 0
+        while True:
+            result = self.results.get()
+            if result is None:
+                break
+            seq, slot, jpeg_data, span = result
+            if self.tracer is not None:
+                pid, started, finished = span
+                self.tracer.record('encode', started, finished, {'seq': seq},
+                                   tid=pid, thread_name=f"EncodeWorker pid {pid}")
+            pending[seq] = (slot, jpeg_data)
+            # Slots are only recycled in order, so in-flight frames never
+            # exceed the ring size even if one worker falls behind
+            while expected in pending:
+                slot, jpeg_data = pending.pop(expected)
+                timestamp = self.timestamps[slot]
+                self.free_slots.put(slot)
+                if jpeg_data is not None and self.on_frame is not None:
+                    try:
+                        self.on_frame(expected, jpeg_data, timestamp)
+                    except Exception as e:
+                        logging.error(f"Error delivering encoded frame {expected}: {e}")
+                expected += 1
+
+    def close(self):
+        """Stop the workers and release the shared memory"""
+        with self.lock:
+            self.closed = True
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join(timeout=2)
+            if worker.is_alive():
+                worker.terminate()
+        self.results.put(None)
+        self.collector.join(timeout=2)
+        del self.ring
+        self.shm.close()
+        self.shm.unlink()
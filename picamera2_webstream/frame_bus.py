@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+import logging
+import struct
+import sys
+import weakref
+from multiprocessing import shared_memory
+from time import sleep, time
+
+import numpy as np
+
+# Shared-memory layout:
+#   header: magic, version, slot count, slot data size, latest frame seq
+#   slots:  seqlock counter, frame seq, length, timestamp, shape, data
+# The writer bumps a slot's seqlock counter to odd before writing and back
+# to even afterwards; readers check it is unchanged after reading.
+HEADER = struct.Struct('<4sIIIQQ')
+HEADER_SIZE = 64
+SLOT_HEADER = struct.Struct('<QQQdIII4x')
+SLOT_HEADER_SIZE = 64
+MAGIC = b'PCWB'
+VERSION = 1
+LATEST_OFFSET = 24
+
+
+def _untrack(shm):
+    """Stop the resource tracker from unlinking a segment this process only attached to"""
+    if sys.version_info < (3, 13):
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+
+
+class FrameBusWriter:
+    """
+    Publish frames into a named shared-memory ring for local readers.
+
+    Publishing never waits on readers: a slot is simply overwritten once
+    the ring wraps, and readers detect that through the slot's seqlock.
+    """
+
+    def __init__(self, name, slot_size, slots=4):
+        self.name = name
+        self.slots = slots
+        self.slot_size = slot_size
+        self.stride = SLOT_HEADER_SIZE + (slot_size + 63) // 64 * 64
+        self.seq = 0
+        self.oversized = 0
+
+        size = HEADER_SIZE + self.stride * slots
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Left over from a previous run that did not shut down cleanly
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        self.buf = self.shm.buf
+        HEADER.pack_into(self.buf, 0, MAGIC, VERSION, slots, 0, slot_size, 0)
+        logging.info(f"Frame bus '{name}' created: {slots} slots of {slot_size} bytes")
+
+    def publish(self, data, timestamp=None):
+        """
+        Copy a frame (bytes or a contiguous array) into the next slot.
+
+        Returns the frame's sequence number, or None if it did not fit.
+        """
+        if isinstance(data, np.ndarray):
+            shape = data.shape + (0,) * (3 - data.ndim)
+            data = np.ascontiguousarray(data).reshape(-1).view(np.uint8)
+        else:
+            shape = (0, 0, 0)
+        length = len(data)
+        if length > self.slot_size:
+            self.oversized += 1
+            return None
+
+        seq = self.seq + 1
+        offset = HEADER_SIZE + (seq % self.slots) * self.stride
+        lock = struct.unpack_from('<Q', self.buf, offset)[0]
+
+        struct.pack_into('<Q', self.buf, offset, lock + 1)
+        start = offset + SLOT_HEADER_SIZE
+        self.buf[start:start + length] = data
+        SLOT_HEADER.pack_into(self.buf, offset, lock + 1, seq, length,
+                              timestamp if timestamp is not None else time(), *shape)
+        struct.pack_into('<Q', self.buf, offset, lock + 2)
+
+        struct.pack_into('<Q', self.buf, LATEST_OFFSET, seq)
+        self.seq = seq
+        return seq
+
+    def close(self):
+        """Remove the shared-memory segment"""
+        self.buf.release()
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class BusFrame:
+    """A zero-copy view of one frame in the bus; check valid() after use"""
+
+    def __init__(self, reader, offset, lock, seq, timestamp, data, shape):
+        self._reader = reader
+        self._offset = offset
+        self._lock = lock
+        self.seq = seq
+        self.timestamp = timestamp
+        self.data = data
+        self.shape = shape
+
+    def array(self, dtype=np.uint8):
+        """View a raw frame as a NumPy array without copying"""
+        return np.frombuffer(self.data, dtype=dtype).reshape(self.shape)
+
+    def valid(self):
+        """True if the writer has not started overwriting this frame"""
+        buf = self._reader.buf
+        if buf is None:
+            return False  # Copied out when the reader closed; it may be torn
+        return struct.unpack_from('<Q', buf, self._offset)[0] == self._lock
+
+    def _detach(self):
+        """Replace the view into the ring with a copy, so the ring can be unmapped"""
+        view = self.data
+        if isinstance(view, memoryview):
+            self.data = bytes(view)
+            view.release()
+
+
+class FrameBusReader:
+    """
+    Read frames published by a FrameBusWriter in another process.
+
+    Readers only ever read the shared memory, so they cannot block or slow
+    down the capture thread. Frames are returned as views into the ring; copy
+    them, or check BusFrame.valid() once finished, if processing might take
+    longer than the ring takes to wrap.
+
+    Pass ``shared_tracker=True`` in processes spawned by the writer's
+    process: they share its resource tracker, which must keep the segment.
+    """
+
+    def __init__(self, name, shared_tracker=False):
+        self.name = name
+        # Frames handed out and still referenced, detached on close()
+        self.frames = weakref.WeakSet()
+        self.shm = shared_memory.SharedMemory(name=name)
+        if not shared_tracker:
+            _untrack(self.shm)
+        self.buf = self.shm.buf
+        magic, version, self.slots, _, self.slot_size, _ = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"'{name}' is not a version {VERSION} frame bus")
+        self.stride = SLOT_HEADER_SIZE + (self.slot_size + 63) // 64 * 64
+
+    @property
+    def latest_seq(self):
+        return struct.unpack_from('<Q', self.buf, LATEST_OFFSET)[0]
+
+    def read_latest(self, after_seq=0):
+        """Return the newest frame if it is newer than after_seq, else None"""
+        for _ in range(3):
+            seq = self.latest_seq
+            if seq <= after_seq:
+                return None
+            offset = HEADER_SIZE + (seq % self.slots) * self.stride
+            lock, slot_seq, length, timestamp, rows, cols, channels = \
+                SLOT_HEADER.unpack_from(self.buf, offset)
+            if lock % 2 or slot_seq != seq:
+                continue  # Being rewritten, look again
+            start = offset + SLOT_HEADER_SIZE
+            shape = tuple(d for d in (rows, cols, channels) if d)
+            frame = BusFrame(self, offset, lock, seq, timestamp,
+                             self.buf[start:start + length], shape)
+            if frame.valid():
+                self.frames.add(frame)
+                return frame
+        return None
+
+    def wait_for_frame(self, after_seq=0, timeout=None, poll_interval=0.005):
+        """Poll until a frame newer than after_seq is published"""
+        deadline = None if timeout is None else time() + timeout
+        while True:
+            frame = self.read_latest(after_seq)
+            if frame is not None:
+                return frame
+            if deadline is not None and time() >= deadline:
+                return None
+            sleep(poll_interval)
+
+    def close(self):
+        """
+        Detach from the bus without removing it.
+
+        Frames still held are copied out of the ring first, so their data
+        stays readable, though valid() then returns False. Arrays made with
+        BusFrame.array() keep the ring mapped until they are garbage collected.
+        """
+        for frame in list(self.frames):
+            frame._detach()
+        self.buf = None
+        try:
+            self.shm.close()
+        except BufferError:
+            logging.debug(f"Frame bus '{self.name}' stays mapped while arrays view it")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+import logging
+import threading
+
+import numpy as np
+
+
+class PooledArray:
+    """
+    A frame array borrowed from a FramePool.
+
+    Starts with one reference. Whoever keeps the array beyond the call that
+    handed it over takes another with ``retain`` and gives it back with
+    ``release``; the array returns to the pool when the last one is released.
+    """
+
+    def __init__(self, pool, array):
+        self.pool = pool
+        self.array = array
+        self.refs = 1
+
+    def retain(self):
+        with self.pool.lock:
+            self.refs += 1
+        return self
+
+    def release(self):
+        with self.pool.lock:
+            self.refs -= 1
+            if self.refs > 0:
+                return
+            if self.refs < 0:
+                raise RuntimeError("Pooled frame released more often than retained")
+        self.pool._put(self)
+
+
+class FramePool:
+    """
+    Preallocated arrays for raw frames, reused instead of allocating a new
+    multi-megabyte array for every capture.
+
+    Arrays are created on first use for the requested shape and dtype; a
+    new shape, e.g. after reconfiguring the camera, empties the pool. If
+    every array is in use a new one is allocated rather than stalling the
+    capture, but at most ``size`` arrays are kept, so memory stays bounded.
+    """
+
+    def __init__(self, size=4):
+        self.size = size
+        self.lock = threading.Lock()
+        self.free = []
+        self.key = None
+        self.allocated = 0
+        self.reused = 0
+
+    def acquire(self, shape, dtype=np.uint8):
+        """Borrow an uninitialised array of ``shape`` and ``dtype``"""
+        key = (tuple(shape), np.dtype(dtype))
+        with self.lock:
+            if key != self.key:
+                if self.key is not None:
+                    logging.info(f"Frame pool resized from {self.key[0]} to {key[0]}")
+                self.key = key
+                self.free = []
+            if self.free:
+                self.reused += 1
+                buffer = self.free.pop()
+                buffer.refs = 1
+                return buffer
+            self.allocated += 1
+        return PooledArray(self, np.empty(shape, dtype))
+
+    def _put(self, buffer):
+        with self.lock:
+            if (buffer.array.shape, buffer.array.dtype) == self.key and len(self.free) < self.size:
+                self.free.append(buffer)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'size': self.size,
+                'free': len(self.free),
+                'allocated': self.allocated,
+                'reused': self.reused,
+            }
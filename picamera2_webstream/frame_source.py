@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+import itertools
+import signal
+import threading
+import logging
+from collections import deque
+from time import monotonic, monotonic_ns, time
+
+from .trace import TRACE_CAPACITY, Tracer
+
+
+# Recent frames kept for /frames/<seq>.jpg
+FRAME_HISTORY = 16
+# Seconds a /frames request keeps frames coming without a streaming client
+POLL_GRACE = 2.0
+# Seconds between recomputations of client rates and egress shares
+EGRESS_INTERVAL = 1.0
+# Seconds of its share a client may send in a burst
+EGRESS_BURST = 0.5
+
+
+def sensor_to_wall_clock(sensor_timestamp):
+    """Map a libcamera SensorTimestamp (monotonic ns) to wall-clock seconds"""
+    return time() - (monotonic_ns() - sensor_timestamp) / 1e9
+
+
+class ClientInfo:
+    """Delivery counters for one streaming client"""
+
+    def __init__(self, client_id, address=None, fps=None, roi=None, priority=None):
+        self.id = client_id
+        self.address = address
+        self.fps = fps
+        self.roi = roi
+        self.priority = priority
+        self.connected_at = time()
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.next_due = 0.0
+
+        # Egress accounting: bytes this client would have been sent without
+        # a budget, its recent rates, and a token bucket refilled at its share
+        self.frames_dropped = 0
+        self.bytes_offered = 0
+        self.rate = 0.0
+        # Unmeasured until the first rate update, so a new client cannot be
+        # handed another client's unused share before it is known to need less
+        self.demand = float('inf')
+        self.rate_marks = (monotonic(), 0, 0)
+        self.share = None
+        self.tokens = 0.0
+        self.refilled = monotonic()
+
+    def wants(self, timestamp, source_fps):
+        """
+        Decide whether a frame captured at ``timestamp`` should be sent.
+
+        Clients without a frame-rate limit get every frame. Limited clients
+        get the first frame at or after each slot of a 1/fps schedule that is
+        anchored to capture time, so the frames they do get are evenly spaced.
+        Half a source frame of tolerance absorbs capture jitter.
+        """
+        if not self.fps or (source_fps and self.fps >= source_fps):
+            return True
+        interval = 1.0 / self.fps
+        tolerance = 0.5 / source_fps if source_fps else 0.0
+        if timestamp + tolerance < self.next_due:
+            return False
+        # Restart the schedule after a stall rather than bursting to catch up
+        self.next_due = max(self.next_due + interval, timestamp + interval - tolerance)
+        return True
+
+    def record(self, nbytes):
+        self.frames_sent += 1
+        self.bytes_sent += nbytes
+
+    def update_rates(self, now):
+        """Recompute the sent and offered byte rates since the last update"""
+        checked, sent, offered = self.rate_marks
+        if now > checked:
+            self.rate = (self.bytes_sent - sent) / (now - checked)
+            self.demand = (self.bytes_offered - offered) / (now - checked)
+        self.rate_marks = (now, self.bytes_sent, self.bytes_offered)
+
+    def take_tokens(self, nbytes, now):
+        """Spend ``nbytes`` of this client's share if available; False drops the frame"""
+        # The bucket always holds at least one frame, so large frames still go out
+        capacity = max(self.share * EGRESS_BURST, nbytes)
+        self.tokens = min(capacity, self.tokens + self.share * (now - self.refilled))
+        self.refilled = now
+        if self.tokens < nbytes:
+            self.frames_dropped += 1
+            return False
+        self.tokens -= nbytes
+        return True
+
+    def as_dict(self):
+        elapsed = max(time() - self.connected_at, 1e-6)
+        return {
+            'id': self.id,
+            'address': self.address,
+            'requested_fps': self.fps,
+            'roi': self.roi,
+            'priority': self.priority,
+            'connected_seconds': round(elapsed, 1),
+            'frames_sent': self.frames_sent,
+            'bytes_sent': self.bytes_sent,
+            'fps': round(self.frames_sent / elapsed, 2),
+            'bytes_per_second': round(self.bytes_sent / elapsed),
+            'current_bytes_per_second': round(self.rate),
+            'egress_share': round(self.share) if self.share is not None else None,
+            'frames_dropped': self.frames_dropped,
+        }
+
+
+class StageTimings:
+    """Processing time, throughput and drops of each pipeline stage"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+
+    def _stage(self, stage):
+        entry = self.stages.get(stage)
+        if entry is None:
+            entry = self.stages[stage] = {'count': 0, 'total': 0.0, 'recent': None,
+                                          'max': 0.0, 'dropped': 0, 'since': monotonic()}
+        return entry
+
+    def record(self, stage, seconds):
+        with self.lock:
+            entry = self._stage(stage)
+            entry['count'] += 1
+            entry['total'] += seconds
+            entry['recent'] = seconds if entry['recent'] is None else \
+                0.9 * entry['recent'] + 0.1 * seconds
+            entry['max'] = max(entry['max'], seconds)
+
+    def drop(self, stage):
+        """Count a frame that a stage dropped or had no room to queue"""
+        with self.lock:
+            self._stage(stage)['dropped'] += 1
+
+    def as_dict(self):
+        now = monotonic()
+        with self.lock:
+            return {stage: {'count': e['count'],
+                            'fps': round(e['count'] / max(now - e['since'], 1e-6), 2),
+                            'dropped': e['dropped'],
+                            'mean_ms': round(e['total'] * 1000 / e['count'], 3) if e['count'] else None,
+                            'recent_ms': round(e['recent'] * 1000, 3) if e['recent'] is not None else None,
+                            'max_ms': round(e['max'] * 1000, 3)}
+                    for stage, e in self.stages.items()}
+
+
+class FrameSource:
+    """
+    Frame state shared between a producer and the web app.
+
+    Subclasses produce JPEG frames and hand each one to ``_publish_frame``;
+    ``create_app`` only relies on the attributes set up here, so any source
+    built on this class can be served.
+
+    ``egress_limit`` caps the total bytes per second sent to all clients.
+    Each client gets a max-min fair share of it: clients that need less
+    than an equal split keep what they need and the rest is divided among
+    the others. A client over its share misses frames; capture is never
+    slowed down.
+
+    Subclasses that implement ``_restart_pipeline`` can also run the stall
+    watchdog, which rebuilds the pipeline when frames stop arriving while
+    clients stay connected and keep receiving the last good frame.
+    """
+
+    def __init__(self, framerate=30):
+        self.lock = threading.Lock()
+        self.frame_ready = threading.Condition(self.lock)
+        self.frame_buffer = None
+        self.frame_seq = 0
+        self.frame_timestamp = None
+        # (seq, timestamp, data) of recent frames; seqs are consecutive
+        # unless the frames come numbered from elsewhere, such as a bus
+        self.frame_history = deque(maxlen=FRAME_HISTORY)
+        self.stop_event = threading.Event()
+        self.frame_count = 0
+        self.clients = 0
+        self.clients_lock = threading.Lock()
+        self.client_info = {}
+        self.client_ids = itertools.count(1)
+        self.framerate = framerate
+        self.measured_fps = None
+        self.jpeg_bus = None
+        self.stage_timings = StageTimings()
+        # Spans of the frame path for /trace; off until enable_tracing()
+        self.tracer = Tracer()
+        self.created_at = time()
+        # Distinguishes frame numbers from those of earlier runs in URLs
+        self.stream_id = format(int(self.created_at * 1000), 'x')
+        self.startup_timings = {}
+        self.egress_limit = None
+        self.egress_checked = monotonic()
+        self.last_poll = None
+        # Viewers in other processes, set by serve_workers
+        self.shared_viewers = None
+        # Favour latency over smoothness at every stage, including the sockets
+        self.low_latency = False
+
+        self.watchdog_timeout = None
+        self.last_frame_monotonic = None
+        self.recovery_lock = threading.Lock()
+        self.recovering_since = None
+        self.recovery_attempts = 0
+        self.recovery_count = 0
+        self.last_recovery_seconds = None
+        self.last_outage_seconds = None
+
+    def latest_frame(self):
+        """Return (seq, capture timestamp, jpeg data) for the newest frame"""
+        with self.lock:
+            return self.frame_seq, self.frame_timestamp, self.frame_buffer
+
+    def frame_by_seq(self, seq):
+        """Return (seq, timestamp, data) for a recent frame, or None if it is not held"""
+        with self.lock:
+            if not self.frame_history:
+                return None
+            index = seq - self.frame_history[0][0]
+            if 0 <= index < len(self.frame_history) and self.frame_history[index][0] == seq:
+                return self.frame_history[index]
+            # Numbering has gaps, e.g. frames a bus reader skipped
+            for entry in self.frame_history:
+                if entry[0] == seq:
+                    return entry
+            return None
+
+    def seq_at(self, timestamp):
+        """Seq of the recent frame captured at ``timestamp``, or None if it is not held"""
+        with self.lock:
+            for seq, frame_timestamp, _ in reversed(self.frame_history):
+                if frame_timestamp == timestamp:
+                    return seq
+            return None
+
+    def wait_for_frame(self, after_seq, timeout=None):
+        """Block until a frame newer than after_seq is published; return the newest seq"""
+        with self.frame_ready:
+            self.frame_ready.wait_for(lambda: self.frame_seq > after_seq, timeout)
+            return self.frame_seq
+
+    def _record_startup(self, phase, started):
+        """Record how long a startup phase took, in seconds since ``started``"""
+        self.startup_timings[phase] = round(time() - started, 3)
+
+    def start_watchdog(self, timeout):
+        """Rebuild the pipeline whenever no frame arrives within ``timeout`` seconds"""
+        self.watchdog_timeout = timeout
+        self.watchdog_thread = threading.Thread(target=self._watchdog,
+                                                daemon=True,
+                                                name="Watchdog")
+        self.watchdog_thread.start()
+
+    def _watchdog(self):
+        """Detect missing frames, including captures that hang without raising"""
+        # The deadline counts from the last frame, or from the last moment no
+        # frames were expected, so idle periods are not mistaken for stalls
+        baseline = monotonic()
+        while not self.stop_event.wait(min(1.0, self.watchdog_timeout / 4)):
+            now = monotonic()
+            if not self._capture_expected():
+                baseline = now
+                continue
+            last = max(baseline, self.last_frame_monotonic or baseline)
+            if now - last > self.watchdog_timeout:
+                self._recover(f"no frame for {now - last:.1f}s")
+                baseline = monotonic()
+
+    def _capture_expected(self):
+        """Whether the producer should currently be delivering frames"""
+        return self.has_viewers()
+
+    def has_viewers(self):
+        """Whether anyone is streaming or has recently polled for frames"""
+        return self.clients > 0 or \
+            (self.last_poll is not None and monotonic() - self.last_poll < POLL_GRACE) or \
+            (self.shared_viewers is not None and self.shared_viewers.active())
+
+    def touch_poll(self):
+        """Record a request for a single frame, which keeps frames coming for a while"""
+        idle = not self.has_viewers()
+        self.last_poll = monotonic()
+        if idle:
+            self._clients_changed()
+
+    def _restart_pipeline(self):
+        """
+        Tear down and rebuild whatever produces frames; return True once rebuilt.
+
+        Sources that can recover from a stall override this. By default
+        nothing is rebuilt, and the watchdog only logs the stall.
+        """
+        logging.warning(f"{type(self).__name__} cannot rebuild its pipeline")
+        return False
+
+    def _recover(self, reason):
+        """
+        Rebuild the pipeline in place; connected clients are left attached.
+
+        Returns True if this call rebuilt it, False if that failed or
+        another thread is already recovering.
+        """
+        if not self.recovery_lock.acquire(blocking=False):
+            return False  # Another thread is already recovering
+        try:
+            if self.stop_event.is_set():
+                return False
+            logging.warning(f"Capture stalled ({reason}); rebuilding pipeline")
+            if self.recovering_since is None:
+                self.recovering_since = monotonic()
+            self.recovery_attempts += 1
+            try:
+                return self._restart_pipeline()
+            except Exception as e:
+                logging.error(f"Error rebuilding pipeline: {e}")
+                return False
+        finally:
+            self.recovery_lock.release()
+
+    def add_client(self, address=None, fps=None, roi=None, priority=None):
+        """Register a streaming client and return its ClientInfo"""
+        with self.clients_lock:
+            client = ClientInfo(next(self.client_ids), address, fps, roi, priority)
+            self.client_info[client.id] = client
+            self.clients += 1
+            logging.info(f"Client connected. Total clients: {self.clients}")
+            self._rebalance_egress(monotonic())
+        self._clients_changed()
+        return client
+
+    def remove_client(self, client):
+        """Unregister a streaming client"""
+        with self.clients_lock:
+            self.client_info.pop(client.id, None)
+            self.clients -= 1
+            logging.info(f"Client disconnected. Remaining clients: {self.clients}")
+            self._rebalance_egress(monotonic())
+        self._clients_changed()
+
+    def _clients_changed(self):
+        """Called after a client connects or disconnects"""
+
+    def set_egress_limit(self, bytes_per_second):
+        """Cap the total bytes per second sent to all clients; None removes the cap"""
+        with self.clients_lock:
+            self.egress_limit = bytes_per_second
+            self._rebalance_egress(monotonic())
+        logging.info(f"Egress limit set to {bytes_per_second} bytes/s")
+
+    def enable_tracing(self, capacity=TRACE_CAPACITY, dump_path=None, dump_signal=signal.SIGUSR1):
+        """
+        Record spans of the frame path, served as Chrome trace JSON by /trace.
+
+        With ``dump_path`` the spans are also written there whenever the
+        process receives ``dump_signal``; call this from the main thread then.
+        """
+        self.tracer.enable(capacity)
+        if dump_path:
+            self.tracer.dump_on_signal(dump_path, dump_signal)
+
+    def allow_frame(self, client, nbytes):
+        """
+        Decide whether a frame of ``nbytes`` may be sent to ``client`` now.
+
+        Called by the web app for each frame a client wants. Without an
+        egress limit every frame is allowed; rates are tracked either way.
+        """
+        now = monotonic()
+        client.bytes_offered += nbytes
+        if now - self.egress_checked >= EGRESS_INTERVAL:
+            with self.clients_lock:
+                self._rebalance_egress(now)
+        if self.egress_limit is None or client.share is None:
+            return True
+        return client.take_tokens(nbytes, now)
+
+    def _rebalance_egress(self, now):
+        """
+        Update client rates and divide the egress limit max-min fairly.
+
+        Must be called with clients_lock held.
+        """
+        if now - self.egress_checked >= EGRESS_INTERVAL:
+            for client in self.client_info.values():
+                client.update_rates(now)
+            self.egress_checked = now
+        if self.egress_limit is None:
+            for client in self.client_info.values():
+                client.share = None
+            return
+
+        # Water-filling: serve the smallest demands first; a client whose
+        # demand fits in an equal split of what is left gets its demand
+        remaining = self.egress_limit
+        pending = sorted(self.client_info.values(), key=lambda c: c.demand)
+        for i, client in enumerate(pending):
+            client.share = min(client.demand, remaining / (len(pending) - i))
+            remaining -= client.share
+        # Budget nobody needs is spread evenly as headroom for rising demand;
+        # either way the shares add up to the limit
+        for client in pending:
+            client.share += remaining / len(pending)
+
+    def get_stats(self):
+        """Snapshot of stream and per-client counters for the /stats endpoint"""
+        with self.clients_lock:
+            clients = [client.as_dict() for client in self.client_info.values()]
+        return {
+            'frame_count': self.frame_count,
+            'frame_seq': self.frame_seq,
+            'target_fps': self.framerate,
+            'measured_fps': round(self.measured_fps, 2) if self.measured_fps else None,
+            'clients': len(clients),
+            'total_bytes_per_second': sum(c['bytes_per_second'] for c in clients),
+            'egress': {
+                'limit': self.egress_limit,
+                'current_bytes_per_second': sum(c['current_bytes_per_second'] for c in clients),
+                'frames_dropped': sum(c['frames_dropped'] for c in clients),
+            },
+            'client_details': clients,
+            'startup': dict(self.startup_timings),
+            'stages': self.stage_timings.as_dict(),
+            'watchdog': {
+                'timeout': self.watchdog_timeout,
+                'recovering': self.recovering_since is not None,
+                'recovery_attempts': self.recovery_attempts,
+                'recoveries': self.recovery_count,
+                'last_recovery_seconds': self.last_recovery_seconds,
+                'last_outage_seconds': self.last_outage_seconds,
+            },
+        }
+
+    def _publish_frame(self, jpeg_data, timestamp=None, seq=None):
+        """
+        Make a newly encoded frame available to clients.
+
+        ``timestamp`` is the wall-clock capture time; it defaults to now.
+        ``seq`` numbers the frame, by default the one after the last.
+        """
+        if timestamp is None:
+            timestamp = time()
+        waiting = monotonic()
+        with self.lock:
+            locked = monotonic()
+            previous = self.frame_timestamp
+            self.frame_buffer = jpeg_data
+            self.frame_seq = seq if seq is not None else self.frame_seq + 1
+            self.frame_timestamp = timestamp
+            self.frame_history.append((self.frame_seq, timestamp, jpeg_data))
+            self.frame_ready.notify_all()
+            seq = self.frame_seq
+
+        now = monotonic()
+        self.tracer.record('frame_lock_wait', waiting, locked, {'seq': seq})
+        if self.recovering_since is not None:
+            self.last_recovery_seconds = round(now - self.recovering_since, 3)
+            if self.last_frame_monotonic is not None:
+                self.last_outage_seconds = round(now - self.last_frame_monotonic, 3)
+            self.recovering_since = None
+            self.recovery_count += 1
+            logging.info(f"Frames flowing again {self.last_recovery_seconds}s after recovery "
+                         f"started ({self.last_outage_seconds}s without frames)")
+        self.last_frame_monotonic = now
+
+        # Gaps while nobody was watching say nothing about the frame rate
+        if previous is not None and 0 < timestamp - previous < 1.0:
+            fps = 1.0 / (timestamp - previous)
+            self.measured_fps = fps if self.measured_fps is None else \
+                0.9 * self.measured_fps + 0.1 * fps
+
+        if self.jpeg_bus is not None:
+            self.jpeg_bus.publish(jpeg_data, timestamp)
+
+        if self.frame_count % 300 == 0:
+            logging.info(f"Stream stats - Frame: {self.frame_count}, "
+                         f"Size: {len(jpeg_data)} bytes, "
+                         f"Clients: {self.clients}")
+        self.frame_count += 1
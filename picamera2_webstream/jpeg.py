@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+JPEG encoding of raw camera frames with the fastest available library.
+
+simplejpeg (python3-simplejpeg, also used by picamera2) and PyTurboJPEG
+both wrap libjpeg-turbo and can encode YUV420 planes directly, skipping
+the conversion to BGR that OpenCV needs. OpenCV is the fallback.
+"""
+import logging
+
+import numpy as np
+
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJPF_BGRX, TJSAMP_420
+    _turbojpeg = TurboJPEG()
+except (ImportError, RuntimeError, OSError):
+    # RuntimeError/OSError: the Python package is there but libturbojpeg is not
+    _turbojpeg = None
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+if simplejpeg is not None:
+    JPEG_BACKEND = "simplejpeg"
+elif _turbojpeg is not None:
+    JPEG_BACKEND = "turbojpeg"
+elif cv2 is not None:
+    JPEG_BACKEND = "opencv"
+else:
+    JPEG_BACKEND = None
+
+# picamera2 names formats by their little-endian word order, so RGB888
+# arrays hold bytes in BGR order
+_SIMPLEJPEG_COLORSPACES = {"RGB888": "BGR", "BGR888": "RGB",
+                           "XRGB8888": "BGRX", "XBGR8888": "RGBX"}
+
+
+def yuv420_planes(frame, width=None):
+    """
+    Split a picamera2 YUV420 array into Y, U and V planes.
+
+    picamera2 shapes YUV420 arrays (height * 3 / 2, stride). Each Y row is
+    ``stride`` bytes, of which the image uses ``width`` (all of them by
+    default), and the U and V planes follow with rows of stride / 2 bytes.
+    Rows are sliced one by one, so padded strides are handled. The planes
+    are views of ``frame``; nothing is copied.
+    """
+    stride = frame.shape[1]
+    height = frame.shape[0] * 2 // 3
+    width = width or stride
+    chroma = frame[height:].reshape(-1)
+    size = height // 2 * (stride // 2)
+    y = frame[:height, :width]
+    u = chroma[:size].reshape(height // 2, stride // 2)[:, :width // 2]
+    v = chroma[size:2 * size].reshape(height // 2, stride // 2)[:, :width // 2]
+    return y, u, v
+
+
+def pack_yuv420(frame, width, out=None):
+    """
+    Copy a YUV420 array with rows padded to its stride into a packed one of
+    shape (height * 3 / 2, width), which every encoder accepts.
+    """
+    y, u, v = yuv420_planes(frame, width)
+    if out is None:
+        out = np.empty((y.shape[0] * 3 // 2, width), frame.dtype)
+    for plane, target in zip((y, u, v), yuv420_planes(out)):
+        np.copyto(target, plane)
+    return out
+
+
+def encode_jpeg(frame, pixel_format="RGB888", quality=85):
+    """Encode a raw frame to JPEG bytes; None if it could not be encoded"""
+    if JPEG_BACKEND == "simplejpeg":
+        if pixel_format == "YUV420":
+            return simplejpeg.encode_jpeg_yuv_planes(*yuv420_planes(frame), quality=quality)
+        return simplejpeg.encode_jpeg(frame, quality=quality,
+                                      colorspace=_SIMPLEJPEG_COLORSPACES.get(pixel_format, "BGR"),
+                                      colorsubsampling='420')
+    if JPEG_BACKEND == "turbojpeg":
+        if pixel_format == "YUV420":
+            height = frame.shape[0] * 2 // 3
+            return _turbojpeg.encode_from_yuv(frame, height, frame.shape[1],
+                                              quality=quality, jpeg_subsample=TJSAMP_420)
+        if pixel_format in ("RGB888", "XRGB8888"):
+            return _turbojpeg.encode(frame, quality=quality, jpeg_subsample=TJSAMP_420,
+                                     pixel_format=TJPF_BGR if pixel_format == "RGB888"
+                                     else TJPF_BGRX)
+    if cv2 is None:
+        logging.error("No JPEG encoder available; install python3-simplejpeg or OpenCV")
+        return None
+    if pixel_format == "YUV420":
+        frame = cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_I420)
+    elif frame.ndim == 3 and frame.shape[2] == 4:
+        frame = frame[:, :, :3]
+    ok, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return encoded.tobytes() if ok else None
+
+
+def decode_jpeg(data):
+    """Decode JPEG bytes to a BGR array, laid out like picamera2's RGB888; None on failure"""
+    try:
+        if simplejpeg is not None:
+            return simplejpeg.decode_jpeg(data, colorspace='BGR')
+        if _turbojpeg is not None:
+            return _turbojpeg.decode(data, pixel_format=TJPF_BGR)
+        if cv2 is not None:
+            return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    except Exception as e:
+        logging.warning(f"Failed to decode JPEG: {e}")
+        return None
+    logging.error("No JPEG decoder available; install python3-simplejpeg or OpenCV")
+    return None
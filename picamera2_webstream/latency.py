@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Measure capture-to-delivery latency of a running stream.
+
+Subscribes to a /video_feed, compares each part's X-Capture-Timestamp with
+the time it arrived, and reports latency percentiles. The clocks of the
+camera host and the measuring host must agree, so run it on the Pi itself
+or on an NTP-synchronised machine:
+
+    python -m picamera2_webstream.latency http://raspberrypi.local:8080/video_feed
+"""
+import argparse
+import logging
+import sys
+import urllib.request
+from time import time
+
+from .relay import parse_boundary, read_multipart
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def measure_latency(url, frames=300, timeout=10):
+    """
+    Receive ``frames`` frames from ``url`` and return latency statistics.
+
+    Latencies are in milliseconds. ``skipped`` counts gaps in X-Frame-Seq,
+    i.e. frames the server published but did not send to this client.
+    ``repeats`` counts keepalive repeats of an already received frame, which
+    are not latency samples: their capture time only gets older.
+    """
+    latencies = []
+    skipped = 0
+    repeats = 0
+    last_seq = None
+    start = time()
+
+    response = urllib.request.urlopen(url, timeout=timeout)
+    try:
+        boundary = parse_boundary(response.headers.get('Content-Type', ''))
+        for headers, body in read_multipart(response, boundary):
+            received = time()
+            if 'x-capture-timestamp' not in headers:
+                raise ValueError("Stream does not send X-Capture-Timestamp headers")
+            seq = int(headers['x-frame-seq']) if 'x-frame-seq' in headers else None
+            if seq is not None and seq == last_seq:
+                repeats += 1
+                continue
+            latencies.append((received - float(headers['x-capture-timestamp'])) * 1000)
+
+            if last_seq is not None and seq is not None and seq > last_seq + 1:
+                skipped += seq - last_seq - 1
+            last_seq = seq
+
+            if len(latencies) >= frames:
+                break
+    finally:
+        response.close()
+
+    elapsed = time() - start
+    ordered = sorted(latencies)
+    return {
+        'frames': len(latencies),
+        'fps': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'skipped': skipped,
+        'repeats': repeats,
+        'min': ordered[0] if ordered else None,
+        'p50': percentile(ordered, 0.50),
+        'p90': percentile(ordered, 0.90),
+        'p99': percentile(ordered, 0.99),
+        'max': ordered[-1] if ordered else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure glass-to-glass stream latency")
+    parser.add_argument('url', help="URL of the /video_feed to measure")
+    parser.add_argument('--frames', type=int, default=300, help="Number of frames to sample")
+    parser.add_argument('--timeout', type=float, default=10, help="Connection timeout in seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    try:
+        stats = measure_latency(args.url, args.frames, args.timeout)
+    except Exception as e:
+        logging.error(f"Latency measurement failed: {e}")
+        sys.exit(1)
+
+    print(f"Frames: {stats['frames']} ({stats['fps']:.1f} fps, {stats['skipped']} skipped, "
+          f"{stats['repeats']} repeated)")
+    if stats['frames']:
+        print(f"Latency ms: min {stats['min']:.1f}  p50 {stats['p50']:.1f}  "
+              f"p90 {stats['p90']:.1f}  p99 {stats['p99']:.1f}  max {stats['max']:.1f}")
+
+
+if __name__ == '__main__':
+    main()
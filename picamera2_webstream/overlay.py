@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+import threading
+from itertools import zip_longest
+from time import localtime, strftime
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+from .jpeg import yuv420_planes
+
+# Rendered when the overlay is created, so the timestamp never waits on a glyph
+PRERENDERED = "0123456789-:/. "
+FONT = cv2.FONT_HERSHEY_SIMPLEX if cv2 is not None else None
+# Luma of the text and of the box behind it, in full-range YCbCr
+FOREGROUND = 235
+BACKGROUND = 16
+
+
+class TextOverlay:
+    """
+    Burn a timestamp and label into raw frames before they are encoded.
+
+    ``text`` is a strftime format, evaluated at each frame's capture time;
+    ``{camera}`` is replaced with ``camera``. Glyphs are drawn once into a
+    cache, and the rendered line is kept as a strip in which only the
+    characters that changed since the last frame are redrawn. Applying the
+    overlay is a single slice assignment into the luma plane (plus neutral
+    chroma under the box), so it costs microseconds per frame. One overlay
+    may be applied from several threads, e.g. to stills and video frames.
+    """
+
+    def __init__(self, text="{camera} %Y-%m-%d %H:%M:%S", camera="", position=(16, 16),
+                 height=24):
+        if cv2 is None:
+            raise ImportError("OpenCV is required to render overlay glyphs")
+        self.template = text.replace('{camera}', camera.replace('%', '%%'))
+        # Even offsets and sizes keep the box aligned with 2x2 chroma blocks
+        self.position = (position[0] & ~1, position[1] & ~1)
+        self.cell_height = max(8, height) & ~1
+        self.thickness = max(1, self.cell_height // 12)
+        self.scale = cv2.getFontScaleFromHeight(FONT, int(self.cell_height * 0.7), self.thickness)
+        (width, _), _ = cv2.getTextSize('W', FONT, self.scale, self.thickness)
+        self.cell_width = (width + 2) & ~1
+
+        # The strip is redrawn in place, so drawing it is serialised
+        self.lock = threading.Lock()
+        self.glyphs = {}
+        for char in PRERENDERED:
+            self._glyph(char)
+        self.text = ""
+        self.strip = np.full((self.cell_height, 0), BACKGROUND, np.uint8)
+
+    def _glyph(self, char):
+        """Luma cell for one character, rendered on first use"""
+        glyph = self.glyphs.get(char)
+        if glyph is None:
+            glyph = np.full((self.cell_height, self.cell_width), BACKGROUND, np.uint8)
+            (width, height), _ = cv2.getTextSize(char, FONT, self.scale, self.thickness)
+            origin = ((self.cell_width - width) // 2, (self.cell_height + height) // 2)
+            cv2.putText(glyph, char, origin, FONT, self.scale, FOREGROUND,
+                        self.thickness, cv2.LINE_AA)
+            self.glyphs[char] = glyph
+        return glyph
+
+    def _update_strip(self, text):
+        """Redraw the cells of the strip whose character changed"""
+        if len(text) != len(self.text):
+            self.strip = np.full((self.cell_height, len(text) * self.cell_width),
+                                 BACKGROUND, np.uint8)
+            self.text = ""
+        w = self.cell_width
+        for i, (new, old) in enumerate(zip_longest(text, self.text)):
+            if new != old:
+                self.strip[:, i * w:(i + 1) * w] = self._glyph(new)
+        self.text = text
+
+    def apply(self, frame, pixel_format, timestamp):
+        """Draw the overlay into ``frame`` in place for a frame captured at ``timestamp``"""
+        with self.lock:
+            text = strftime(self.template, localtime(timestamp))
+            if text != self.text:
+                self._update_strip(text)
+
+            x, y = self.position
+            if pixel_format == "YUV420":
+                luma, u, v = yuv420_planes(frame)
+            else:
+                luma = frame
+            height = min(self.cell_height, luma.shape[0] - y) & ~1
+            width = min(self.strip.shape[1], luma.shape[1] - x) & ~1
+            if height <= 0 or width <= 0:
+                return
+
+            strip = self.strip[:height, :width]
+            if pixel_format == "YUV420":
+                luma[y:y + height, x:x + width] = strip
+                u[y // 2:(y + height) // 2, x // 2:(x + width) // 2] = 128
+                v[y // 2:(y + height) // 2, x // 2:(x + width) // 2] = 128
+            elif frame.ndim == 3:
+                # Equal channels keep the text neutral grey in any RGB order
+                frame[y:y + height, x:x + width, :3] = strip[:, :, None]
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+import itertools
+import logging
+import queue
+import threading
+from time import monotonic
+
+from .frame_source import StageTimings
+
+DROP_POLICIES = ('block', 'drop_newest', 'drop_oldest')
+
+
+class Frame:
+    """
+    A captured frame on its way through a Pipeline.
+
+    ``array`` holds raw pixels in ``pixel_format``, or is None if the camera
+    delivered JPEG, which is then in ``jpeg``. Stages may modify the array
+    in place, set ``jpeg``, and leave results for later stages in ``data``.
+
+    The array may be borrowed from a FramePool (``buffer``) and is reused for
+    a later capture once the frame leaves the pipeline, so a stage that
+    keeps pixels beyond its call must copy them.
+    """
+
+    def __init__(self, array=None, pixel_format=None, timestamp=None, metadata=None, jpeg=None,
+                 buffer=None):
+        self.buffer = buffer
+        self.array = array
+        self.pixel_format = pixel_format
+        self.timestamp = timestamp
+        self.metadata = metadata or {}
+        self.jpeg = jpeg
+        self.data = {}
+
+    def retain(self):
+        if self.buffer is not None:
+            self.buffer.retain()
+
+    def release(self):
+        if self.buffer is not None:
+            self.buffer.release()
+
+
+class Stage:
+    """
+    One step of a Pipeline.
+
+    Pass a function, or subclass and override ``process``. Either takes a
+    Frame and returns the same Frame, usually modified in place, or returns
+    None to drop it. An exception also drops the frame, so a failing mask never
+    lets an unmasked frame through.
+
+    With ``threads=0`` the stage runs on whichever thread delivers the frame.
+    With ``threads=N`` frames are queued for N worker threads, up to
+    ``queue_size`` of them. When the queue is full, ``drop_policy`` either
+    waits for room (``block``), discards the incoming frame
+    (``drop_newest``), or discards the oldest queued frame (``drop_oldest``).
+    Frames leave a threaded stage in the order they entered it.
+
+    A ``tap`` stage sees every frame but does not hold up or alter the
+    stream: frames carry on immediately and its result is ignored. Use it
+    for analysis, such as motion detection, which must not modify the frame.
+    """
+
+    def __init__(self, name, func=None, threads=0, queue_size=2, drop_policy='drop_oldest',
+                 tap=False):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"drop_policy must be one of {', '.join(DROP_POLICIES)}")
+        self.name = name
+        self.func = func
+        self.threads = threads
+        self.queue_size = queue_size
+        self.drop_policy = drop_policy
+        self.tap = tap
+        self._queue = None
+
+    def process(self, frame):
+        return self.func(frame) if self.func is not None else frame
+
+    def _start(self, run, deliver, timings):
+        """Start the worker threads; ``run`` processes a frame, ``deliver`` passes it on"""
+        self._run = run
+        self._deliver = deliver
+        self._timings = timings
+        self._queue = queue.Queue(self.queue_size)
+        self._tickets = itertools.count()
+        self._enqueue_lock = threading.Lock()
+        self._order_lock = threading.Lock()
+        self._next_ticket = 0
+        self._finished = {}
+        self._workers = [threading.Thread(target=self._work, daemon=True,
+                                          name=f"Stage-{self.name}-{i}")
+                         for i in range(self.threads)]
+        for worker in self._workers:
+            worker.start()
+
+    def _enqueue(self, frame):
+        """Queue a frame for the workers, applying the drop policy when full"""
+        with self._enqueue_lock:
+            if self._queue.full():
+                if self.drop_policy == 'drop_newest':
+                    self._timings.drop(self.name)
+                    frame.release()
+                    return
+                if self.drop_policy == 'drop_oldest':
+                    try:
+                        ticket, dropped = self._queue.get_nowait()
+                        self._timings.drop(self.name)
+                        dropped.release()
+                        self._finish(ticket, None)
+                    except queue.Empty:
+                        pass
+            self._queue.put((next(self._tickets), frame))
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            ticket, frame = item
+            result = self._run(self, frame)
+            if self.tap:
+                frame.release()
+            self._finish(ticket, result)
+
+    def _finish(self, ticket, frame):
+        """Pass finished frames on in the order they were queued"""
+        with self._order_lock:
+            self._finished[ticket] = frame
+            while self._next_ticket in self._finished:
+                done = self._finished.pop(self._next_ticket)
+                self._next_ticket += 1
+                if done is not None and not self.tap:
+                    self._deliver(done)
+
+    def _stop(self):
+        if self._queue is None:
+            return
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout=2)
+
+
+class Pipeline:
+    """
+    Ordered stages between the camera and the published stream.
+
+    Frames are handed in with ``submit`` and, unless a stage drops them, end
+    at ``sink``; either way they are then released. The latency, throughput
+    and drops of every stage and of the sink are recorded in ``timings``
+    under the stage name, and each run is also a span in ``tracer`` if one
+    is given.
+    """
+
+    def __init__(self, stages=(), sink=None, sink_name='publish', timings=None, tracer=None):
+        self.stages = list(stages)
+        self.sink = sink
+        self.sink_name = sink_name
+        self.timings = timings if timings is not None else StageTimings()
+        self.tracer = tracer
+        self.started = False
+
+    def add(self, stage, before=None):
+        """Add a stage at the end, or before the stage called ``before``"""
+        if self.started:
+            raise RuntimeError("Stages must be added before the pipeline starts")
+        if any(existing.name == stage.name for existing in self.stages):
+            raise ValueError(f"Pipeline already has a stage called '{stage.name}'")
+        names = [existing.name for existing in self.stages]
+        if before is None:
+            self.stages.append(stage)
+        elif before in names:
+            self.stages.insert(names.index(before), stage)
+        else:
+            raise ValueError(f"No pipeline stage called '{before}'")
+
+    def start(self):
+        for index, stage in enumerate(self.stages):
+            if stage.threads:
+                stage._start(self._process, lambda frame, i=index: self._run(frame, i + 1),
+                             self.timings)
+        self.started = True
+        return self
+
+    def stop(self):
+        for stage in self.stages:
+            if stage.threads:
+                stage._stop()
+        self.started = False
+
+    def capacity(self):
+        """Most frames the pipeline can hold at once: one inline plus every queue and worker"""
+        return 1 + sum(stage.queue_size + stage.threads for stage in self.stages if stage.threads)
+
+    def submit(self, frame):
+        """Run a frame through the pipeline from the first stage"""
+        self._run(frame, 0)
+
+    def _run(self, frame, index):
+        """Run ``frame`` from stage ``index`` until it is dropped, queued or sunk"""
+        for stage in self.stages[index:]:
+            if stage.threads:
+                if stage.tap:
+                    # The tap holds its own reference until it is done
+                    frame.retain()
+                stage._enqueue(frame)
+                if not stage.tap:
+                    return
+            elif stage.tap:
+                self._process(stage, frame)
+            else:
+                frame = self._process(stage, frame)
+                if frame is None:
+                    return
+        try:
+            if self.sink is not None:
+                started = monotonic()
+                self.sink(frame)
+                self._record(self.sink_name, started, monotonic())
+        finally:
+            frame.release()
+
+    def _process(self, stage, frame):
+        """Run one stage on a frame, timing it; None if the frame was dropped"""
+        started = monotonic()
+        try:
+            result = stage.process(frame)
+        except Exception as e:
+            logging.error(f"Pipeline stage {stage.name} failed: {e}")
+            result = None
+        self._record(stage.name, started, monotonic())
+        if result is None and not stage.tap:
+            self.timings.drop(stage.name)
+            frame.release()
+        return result
+
+    def _record(self, name, started, finished):
+        self.timings.record(name, finished - started)
+        if self.tracer is not None:
+            self.tracer.record(name, started, finished)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+import logging
+import threading
+
+import numpy as np
+
+from .jpeg import yuv420_planes
+
+
+def parse_polygon(text):
+    """
+    Parse a polygon written as ``x,y x,y x,y ...``.
+
+    Coordinates are fractions (0.0 to 1.0) of the camera's field of view,
+    like ROIs, so a mask covers the same area at every resolution and zoom.
+    Raises ValueError if the polygon is invalid.
+    """
+    try:
+        points = tuple(tuple(float(v) for v in point.split(',')) for point in text.split())
+    except ValueError:
+        raise ValueError(f"Polygon points must be x,y pairs, got '{text}'")
+    if len(points) < 3 or any(len(point) != 2 for point in points):
+        raise ValueError(f"Polygon needs at least three x,y points, got '{text}'")
+    if any(not (0.0 <= v <= 1.0) for point in points for v in point):
+        raise ValueError(f"Polygon {text} is outside the frame")
+    return points
+
+
+def rasterize(polygons, width, height):
+    """
+    Boolean (height, width) mask of the pixels whose centres lie inside any
+    polygon, using the even-odd rule evaluated for all pixels at once.
+    """
+    mask = np.zeros((height, width), bool)
+    ys = (np.arange(height) + 0.5)[:, None] / height
+    xs = (np.arange(width) + 0.5)[None, :] / width
+    for polygon in polygons:
+        inside = np.zeros((height, width), bool)
+        for (x0, y0), (x1, y1) in zip(polygon, polygon[1:] + polygon[:1]):
+            if y0 == y1:
+                continue
+            # Rows this edge spans, and where the edge crosses each of them
+            spans = (ys >= min(y0, y1)) & (ys < max(y0, y1))
+            crossing = x0 + (ys - y0) * (x1 - x0) / (y1 - y0)
+            inside ^= spans & (xs < crossing)
+        mask |= inside
+    return mask
+
+
+# Rasterized masks kept; more distinct sizes and crops than this empty the cache
+MASK_CACHE_SIZE = 16
+
+
+class PrivacyMask:
+    """
+    Black out polygonal regions of every frame before it is encoded.
+
+    Polygons are fractions of ``sensor_area``, the camera's ScalerCropMaximum
+    in sensor pixels, the same coordinates ROIs use. Each frame is masked
+    for the crop it shows (its ``ScalerCrop``), so a mask stays on the same
+    part of the scene when the ISP crops to the output's aspect ratio or an
+    ROI zooms in. Without a ``sensor_area`` or crop the polygons are
+    fractions of the frame itself.
+
+    Each polygon is rasterized once per frame size and crop, and only the
+    bounding box of the mask is kept. Applying it is one vectorised
+    ``np.copyto`` into that box, per plane, which costs well under a
+    millisecond at 1080p.
+    """
+
+    def __init__(self, polygons, sensor_area=None):
+        self.polygons = tuple(parse_polygon(p) if isinstance(p, str) else tuple(map(tuple, p))
+                              for p in polygons)
+        self.sensor_area = sensor_area
+        self.lock = threading.Lock()
+        self.cache = {}
+
+    def polygons_for(self, crop):
+        """The polygons as fractions of ``crop``, a sensor-pixel (x, y, width, height)"""
+        if crop is None or self.sensor_area is None:
+            return self.polygons
+        area_x, area_y, area_width, area_height = self.sensor_area
+        crop_x, crop_y, crop_width, crop_height = crop
+        return tuple(tuple(((area_x + x * area_width - crop_x) / crop_width,
+                            (area_y + y * area_height - crop_y) / crop_height)
+                           for x, y in polygon)
+                     for polygon in self.polygons)
+
+    def _prepared(self, width, height, channels=None, crop=None):
+        """
+        Bounding box slices and cropped mask for a frame size and crop, computed once.
+
+        With ``channels`` the mask is repeated across them up front, which
+        is several times faster to apply than broadcasting it every frame.
+        """
+        key = (width, height, channels, tuple(crop) if crop is not None else None)
+        with self.lock:
+            prepared = self.cache.get(key, False)
+            if prepared is False:
+                if len(self.cache) >= MASK_CACHE_SIZE:
+                    self.cache.clear()
+                mask = rasterize(self.polygons_for(crop), width, height)
+                rows, cols = np.nonzero(mask.any(axis=1))[0], np.nonzero(mask.any(axis=0))[0]
+                prepared = None  # Nothing to mask in this crop
+                if len(rows):
+                    box = (slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1))
+                    cropped = mask[box]
+                    if channels:
+                        cropped = np.repeat(cropped[:, :, None], channels, axis=2)
+                    prepared = (box, cropped)
+                self.cache[key] = prepared
+                logging.info(f"Privacy mask covers {mask.mean():.1%} of {width}x{height} frames"
+                             + (f" cropped to {tuple(crop)}" if crop is not None else ""))
+            return prepared
+
+    def apply(self, frame, pixel_format="RGB888", crop=None):
+        """
+        Mask ``frame`` in place. ``pixel_format`` is a picamera2 format name,
+        and ``crop`` the frame's ScalerCrop, if known.
+        """
+        if pixel_format == "YUV420":
+            luma, u, v = yuv420_planes(frame)
+            prepared = self._prepared(luma.shape[1], luma.shape[0], crop=crop)
+            if prepared is not None:
+                box, mask = prepared
+                np.copyto(luma[box], 0, where=mask)
+            # The chroma planes get their own, half-resolution mask
+            prepared = self._prepared(u.shape[1], u.shape[0], crop=crop)
+            if prepared is not None:
+                box, mask = prepared
+                np.copyto(u[box], 128, where=mask)
+                np.copyto(v[box], 128, where=mask)
+            return
+        channels = frame.shape[2] if frame.ndim == 3 else None
+        prepared = self._prepared(frame.shape[1], frame.shape[0], channels, crop)
+        if prepared is not None:
+            box, mask = prepared
+            np.copyto(frame[box], 0, where=mask)
+
+    def write_rgba(self, path, width, height):
+        """
+        Write the mask as one raw RGBA frame: opaque black inside the
+        polygons, transparent elsewhere. FFmpeg overlays it on its output.
+        """
+        rgba = np.zeros((height, width, 4), np.uint8)
+        rgba[rasterize(self.polygons, width, height), 3] = 255
+        with open(path, 'wb') as f:
+            f.write(rgba.tobytes())
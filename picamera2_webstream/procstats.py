@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+"""CPU time and memory use of processes, read from /proc."""
+import os
+
+
+def read_process_usage(pid):
+    """Return (cpu seconds, rss bytes) for a process from /proc, or None"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # Fields after the parenthesised command name; utime and stime
+            # are the 14th and 15th fields overall
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        with open(f'/proc/{pid}/statm') as f:
+            rss_bytes = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        return cpu_seconds, rss_bytes
+    except (OSError, ValueError, IndexError):
+        return None
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+import logging
+import threading
+import urllib.request
+
+from .frame_source import FrameSource
+
+
+def parse_boundary(content_type):
+    """Extract the multipart boundary from a Content-Type header"""
+    for param in content_type.split(';')[1:]:
+        key, _, value = param.strip().partition('=')
+        if key.lower() == 'boundary':
+            return value.strip('"').encode()
+    return b'frame'
+
+
+def read_multipart(stream, boundary=b'frame'):
+    """
+    Yield ``(headers, body)`` for each part of a multipart/x-mixed-replace stream.
+
+    Parts with a Content-Length are read in one call. Parts without one, as
+    sent by the FFmpeg backend, are read up to the next boundary line.
+    """
+    delimiter = b'--' + boundary
+    line = stream.readline()
+    while line:
+        if not line.startswith(delimiter):
+            line = stream.readline()
+            continue
+
+        headers = {}
+        while True:
+            line = stream.readline()
+            if not line:
+                return
+            line = line.strip()
+            if not line:
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+
+        if 'content-length' in headers:
+            body = stream.read(int(headers['content-length']))
+            if len(body) < int(headers['content-length']):
+                return
+            yield headers, body
+            line = stream.readline()
+        else:
+            chunks = []
+            line = stream.readline()
+            while line and not line.startswith(delimiter):
+                chunks.append(line)
+                line = stream.readline()
+            if not line:
+                return
+            body = b''.join(chunks)
+            if body.endswith(b'\r\n'):
+                body = body[:-2]
+            yield headers, body
+
+
+class RelayStream(FrameSource):
+    """
+    Re-serve another instance's /video_feed.
+
+    One upstream connection is parsed once and its frames are published like
+    a local camera, so ``create_app`` can fan them out to many viewers. The
+    connection is re-established with exponential backoff whenever it drops,
+    which also makes relays chainable. Keepalive repeats of a frame, which
+    carry the X-Frame-Seq already seen, are not published again.
+    """
+
+    def __init__(self, url, framerate=30, timeout=10, max_backoff=30):
+        super().__init__(framerate)
+        self.url = url
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.reconnects = 0
+        self.connected = False
+        self.response = None
+
+    def start(self):
+        """Start the upstream reader thread"""
+        self.relay_thread = threading.Thread(target=self._relay_frames,
+                                             daemon=True,
+                                             name="RelayThread")
+        self.relay_thread.start()
+        logging.info(f"Relaying {self.url}")
+        return self
+
+    def stop(self):
+        """Stop relaying"""
+        self.stop_event.set()
+        response = self.response
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+    def _relay_frames(self):
+        """Read the upstream stream, reconnecting whenever it drops"""
+        backoff = 1
+        while not self.stop_event.is_set():
+            try:
+                self.response = urllib.request.urlopen(self.url, timeout=self.timeout)
+                boundary = parse_boundary(self.response.headers.get('Content-Type', ''))
+                self.connected = True
+                logging.info(f"Connected to upstream {self.url}")
+                upstream_seq = None
+                for headers, body in read_multipart(self.response, boundary):
+                    if self.stop_event.is_set():
+                        break
+                    seq = headers.get('x-frame-seq')
+                    if seq is not None and seq == upstream_seq:
+                        continue  # Upstream is repeating its last frame
+                    upstream_seq = seq
+                    # Keep the original capture time so latency can be
+                    # measured end to end across relays
+                    timestamp = headers.get('x-capture-timestamp')
+                    self._publish_frame(body, float(timestamp) if timestamp else None)
+                    backoff = 1
+                logging.warning("Upstream stream ended")
+            except Exception as e:
+                if self.stop_event.is_set():
+                    break
+                logging.error(f"Upstream error: {e}")
+            finally:
+                self.connected = False
+                if self.response is not None:
+                    self.response.close()
+
+            if self.stop_event.is_set():
+                break
+            self.reconnects += 1
+            logging.info(f"Reconnecting to upstream in {backoff}s")
+            self.stop_event.wait(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+import logging
+import threading
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+from .jpeg import JPEG_BACKEND, decode_jpeg, encode_jpeg, yuv420_planes
+
+# picamera2 formats whose arrays can be cropped by slicing
+RAW_FORMATS = ("RGB888", "BGR888", "XRGB8888", "XBGR8888", "YUV420")
+
+
+def parse_roi(text):
+    """
+    Parse an ``x,y,w,h`` region of interest.
+
+    Values are fractions of the full frame (0.0 to 1.0), so the same ROI
+    works at any resolution. Raises ValueError if the region is invalid.
+    """
+    try:
+        x, y, w, h = (float(v) for v in text.split(','))
+    except ValueError:
+        raise ValueError(f"ROI must be four comma-separated numbers, got '{text}'")
+    if w <= 0 or h <= 0 or x < 0 or y < 0 or x + w > 1.0 or y + h > 1.0:
+        raise ValueError(f"ROI {text} is outside the frame")
+    return (x, y, w, h)
+
+
+def roi_to_scaler_crop(roi, crop_maximum):
+    """Convert a fractional ROI to a libcamera ScalerCrop rectangle in sensor pixels"""
+    x0, y0, width, height = crop_maximum
+    x, y, w, h = roi
+    return (x0 + int(x * width), y0 + int(y * height),
+            max(1, int(w * width)), max(1, int(h * height)))
+
+
+def parse_size(text):
+    """Parse a ``WIDTHxHEIGHT`` output size; raises ValueError if it is not one"""
+    try:
+        width, height = (int(v) for v in text.lower().split('x'))
+    except ValueError:
+        raise ValueError(f"size must be WIDTHxHEIGHT, got '{text}'")
+    if width < 2 or height < 2:
+        raise ValueError(f"size {text} is too small")
+    return width, height
+
+
+def _crop_box(width, height, roi, align=1):
+    """Pixel bounds (left, top, right, bottom) of an ROI, aligned to ``align``"""
+    x, y, w, h = roi
+    left, top = int(x * width) // align * align, int(y * height) // align * align
+    right = max(left + align, int((x + w) * width) // align * align)
+    bottom = max(top + align, int((y + h) * height) // align * align)
+    return left, top, right, bottom
+
+
+def _output_size(width, height, size, align=1):
+    """Fit a crop into ``size`` keeping its aspect ratio; crops are never enlarged"""
+    if size is None:
+        return width, height
+    scale = min(size[0] / width, size[1] / height, 1.0)
+    return (max(align, int(width * scale) // align * align),
+            max(align, int(height * scale) // align * align))
+
+
+def _scale(image, width, height):
+    """Resize an image or plane, with OpenCV if it is installed"""
+    if image.shape[1] == width and image.shape[0] == height:
+        return image
+    if cv2 is not None:
+        return cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+    # Nearest neighbour, which NumPy can do with two index arrays
+    rows = np.arange(height) * image.shape[0] // height
+    cols = np.arange(width) * image.shape[1] // width
+    return image[rows[:, None], cols]
+
+
+def crop_frame(frame, roi):
+    """Return a view of the region of a BGR frame; no pixels are copied"""
+    left, top, right, bottom = _crop_box(frame.shape[1], frame.shape[0], roi)
+    return frame[top:bottom, left:right]
+
+
+def crop_yuv420(frame, roi, size=None):
+    """
+    Crop a YUV420 frame plane by plane, and scale it to fit ``size``.
+
+    Bounds are rounded to even pixels so the chroma planes crop exactly.
+    Returns a new packed YUV420 array; only the region is ever converted.
+    """
+    y, u, v = yuv420_planes(frame)
+    left, top, right, bottom = _crop_box(y.shape[1], y.shape[0], roi, align=2)
+    width, height = _output_size(right - left, bottom - top, size, align=2)
+    cropped = np.empty((height * 3 // 2, width), frame.dtype)
+    out_y, out_u, out_v = yuv420_planes(cropped)
+    out_y[...] = _scale(y[top:bottom, left:right], width, height)
+    for plane, out in ((u, out_u), (v, out_v)):
+        out[...] = _scale(plane[top // 2:bottom // 2, left // 2:right // 2],
+                          width // 2, height // 2)
+    return cropped
+
+
+def crop_image(frame, roi, size=None):
+    """Crop an interleaved RGB-style frame and scale it to fit ``size``"""
+    crop = crop_frame(frame, roi)
+    width, height = _output_size(crop.shape[1], crop.shape[0], size)
+    return np.ascontiguousarray(_scale(crop, width, height))
+
+
+class RoiStreams:
+    """
+    Cropped sub-streams of the main camera stream.
+
+    Each distinct ROI and output size that clients ask for is cropped and
+    encoded once per frame and shared by every client watching it, so the
+    cost scales with the number of different regions, not the number of
+    viewers. Crops are cut from the raw planes before any conversion and
+    encoded with the same JPEG backend as the main stream.
+    """
+
+    def __init__(self, quality=85, max_rois=4):
+        self.quality = quality
+        self.max_rois = max_rois
+        self.lock = threading.Lock()
+        self.active = {}
+        self.frames = {}
+
+    @property
+    def available(self):
+        """Whether ROI crops can be encoded; any of the JPEG backends will do"""
+        return JPEG_BACKEND is not None
+
+    def acquire(self, roi, size=None):
+        """Register a client for an ROI; False if too many distinct ROIs are active"""
+        key = (roi, size)
+        with self.lock:
+            if key not in self.active and len(self.active) >= self.max_rois:
+                return False
+            self.active[key] = self.active.get(key, 0) + 1
+            return True
+
+    def release(self, roi, size=None):
+        """Unregister a client, dropping the ROI when nobody watches it"""
+        key = (roi, size)
+        with self.lock:
+            self.active[key] -= 1
+            if self.active[key] <= 0:
+                del self.active[key]
+                self.frames.pop(key, None)
+
+    def latest(self, roi, size=None):
+        """Return (capture timestamp, jpeg data) for an ROI, or (None, None)"""
+        with self.lock:
+            return self.frames.get((roi, size), (None, None))
+
+    def render(self, timestamp, array=None, pixel_format="RGB888", jpeg_data=None):
+        """
+        Encode every active ROI from one captured frame.
+
+        Crops are taken from the raw ``array`` when the camera delivers a
+        raw format, otherwise from ``jpeg_data`` decoded once for all ROIs.
+        """
+        with self.lock:
+            keys = list(self.active)
+        if not keys:
+            return
+
+        if array is None or pixel_format not in RAW_FORMATS:
+            array, pixel_format = decode_jpeg(jpeg_data), "RGB888"
+            if array is None:
+                return
+
+        for roi, size in keys:
+            if pixel_format == "YUV420":
+                crop = crop_yuv420(array, roi, size)
+            else:
+                crop = crop_image(array, roi, size)
+            encoded = encode_jpeg(crop, pixel_format, self.quality)
+            if encoded is None:
+                logging.warning(f"Failed to encode ROI {roi}")
+                continue
+            with self.lock:
+                if (roi, size) in self.active:
+                    self.frames[(roi, size)] = (timestamp, encoded)
@@ -1,156 +1,353 @@
 #!/usr/bin/env python3
+import os
 import subprocess
+import tempfile
 import threading
 import logging
-from flask import Flask, Response
-import io
-import signal
-from time import sleep
+from time import monotonic, time
 
-class VideoStream:
-    def __init__(self, width=1280, height=720, framerate=30, device='/dev/video0'):
+from .camera_utils import get_privacy_masks
+from .frame_source import FrameSource
+from .privacy import PrivacyMask
+from .procstats import read_process_usage
+from .stream_picamera import create_app as create_stream_app
+
+# Warn when FFmpeg's speed falls below this fraction of real time; live
+# capture normally reports 0.99x-1.01x, so leave some room for jitter
+SLOW_SPEED_THRESHOLD = 0.95
+# Seconds between repeated warnings about FFmpeg running slower than real time
+SLOW_WARNING_INTERVAL = 30
+# A process that has run this long resets the restart backoff
+STABLE_RUN_SECONDS = 30
+# Seconds between CPU/RSS samples of the FFmpeg process
+USAGE_SAMPLE_INTERVAL = 2.0
+# Input options in low-latency mode: no demuxer buffering or decoder delay
+LOW_LATENCY_INPUT_OPTIONS = ('-fflags', 'nobuffer', '-flags', 'low_delay')
+
+def parse_progress_value(key, value):
+    """Convert one ``-progress`` value to a number where it is numeric"""
+    if value in ('N/A', ''):
+        return None
+    try:
+        if key == 'speed':
+            return float(value.rstrip('x'))
+        if key == 'bitrate':
+            return float(value.replace('kbits/s', ''))
+        if key in ('fps', 'stream_0_0_q'):
+            return float(value)
+        if key in ('frame', 'total_size', 'out_time_us', 'out_time_ms',
+                   'dup_frames', 'drop_frames'):
+            return int(value)
+    except ValueError:
+        return None
+    return value
+
+class VideoStream(FrameSource):
+    """
+    Stream a V4L2 device through an FFmpeg subprocess.
+
+    With ``on_demand`` the subprocess only runs while someone is watching:
+    it starts when the first client connects and stops ``idle_timeout``
+    seconds after the last one leaves. If FFmpeg exits unexpectedly it is
+    restarted with exponential backoff up to ``max_backoff`` seconds.
+
+    ``low_latency`` removes FFmpeg's input and output buffering and reads
+    its pipe unbuffered, so each frame is published as soon as it is written.
+    """
+
+    def __init__(self, width=1280, height=720, framerate=30, device='/dev/video0',
+                 watchdog_timeout=5.0, on_demand=True, idle_timeout=30, max_backoff=60,
+                 privacy_masks=None, low_latency=False):
+        super().__init__(framerate)
+        self.low_latency = low_latency
         self.width = width
         self.height = height
-        self.framerate = framerate
         self.device = device
         self.process = None
-        self.lock = threading.Lock()
-        self.clients = 0
-        self.clients_lock = threading.Lock()
-        self.stop_event = threading.Event()
+        self.process_lock = threading.RLock()
+        self.watchdog_timeout = watchdog_timeout
+        self.progress = {}
+        self.progress_updated = None
+        self.slow_warned = 0
+
+        self.on_demand = on_demand
+        self.idle_timeout = idle_timeout
+        self.max_backoff = max_backoff
+        self.backoff = 1
+        self.restart_at = 0
+        self.process_started_at = None
+        self.idle_since = None
+        self.starts = 0
+        self.unexpected_exits = 0
+        self.supervisor_wake = threading.Event()
+        self.usage_sample = None
+        self.cpu_percent = None
+        self.rss_bytes = None
+
+        # Polygons blacked out by FFmpeg itself; None reads them from config.ini
+        if privacy_masks is None:
+            privacy_masks = get_privacy_masks()
+        self.privacy_mask = PrivacyMask(privacy_masks) if privacy_masks else None
+        self.mask_path = None
 
     def start(self):
+        self.supervisor_thread = threading.Thread(target=self._supervise,
+                                                  daemon=True,
+                                                  name="FFmpegSupervisor")
+        self.supervisor_thread.start()
+        if self.watchdog_timeout:
+            self.start_watchdog(self.watchdog_timeout)
+        return self
+
+    def _clients_changed(self):
+        """Wake the supervisor so the first viewer does not wait for its next tick"""
+        self.supervisor_wake.set()
+
+    def _process_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def _supervise(self):
+        """Start, stop and restart FFmpeg to match demand"""
+        while not self.stop_event.is_set():
+            self.supervisor_wake.wait(0.5)
+            self.supervisor_wake.clear()
+            if self.stop_event.is_set():
+                break
+            now = monotonic()
+            if self.has_viewers():
+                self.idle_since = now
+            wanted = not self.on_demand or \
+                (self.idle_since is not None and now - self.idle_since < self.idle_timeout)
+
+            with self.process_lock:
+                if self.process is not None and self.process.poll() is not None:
+                    self.unexpected_exits += 1
+                    logging.warning(f"FFmpeg exited unexpectedly with code "
+                                    f"{self.process.returncode}; restarting in {self.backoff}s")
+                    self.process = None
+                    self.restart_at = now + self.backoff
+                    self.backoff = min(self.backoff * 2, self.max_backoff)
+
+                if wanted and self.process is None and now >= self.restart_at:
+                    try:
+                        self._start_process()
+                    except Exception as e:
+                        logging.error(f"Error starting FFmpeg: {e}")
+                        self.restart_at = now + self.backoff
+                        self.backoff = min(self.backoff * 2, self.max_backoff)
+                elif not wanted and self.process is not None:
+                    logging.info(f"No viewers for {self.idle_timeout}s; stopping FFmpeg")
+                    self._terminate_process()
+
+                if self._process_running():
+                    if now - self.process_started_at > STABLE_RUN_SECONDS:
+                        self.backoff = 1
+                    self._sample_usage(now)
+
+    def _sample_usage(self, now):
+        """Track the FFmpeg process's CPU share and resident memory"""
+        if self.usage_sample is not None and now - self.usage_sample[0] < USAGE_SAMPLE_INTERVAL:
+            return
+        usage = read_process_usage(self.process.pid)
+        if usage is None:
+            return
+        cpu_seconds, self.rss_bytes = usage
+        if self.usage_sample is not None and self.usage_sample[2] == self.process.pid:
+            elapsed = now - self.usage_sample[0]
+            self.cpu_percent = round(100 * (cpu_seconds - self.usage_sample[1]) / elapsed, 1)
+        self.usage_sample = (now, cpu_seconds, self.process.pid)
+
+    def _video_filter(self):
+        """
+        Input and filter arguments: scaling, plus the privacy mask overlaid
+        from a one-frame RGBA image that FFmpeg repeats for every frame.
+        """
+        scale = f'scale={self.width}:{self.height}'
+        if self.privacy_mask is None:
+            return ['-vf', scale]
+        if self.mask_path is None:
+            with tempfile.NamedTemporaryFile(prefix='privacy-mask-', suffix='.rgba',
+                                             delete=False) as f:
+                self.mask_path = f.name
+            self.privacy_mask.write_rgba(self.mask_path, self.width, self.height)
+        return [
+            '-f', 'rawvideo', '-pix_fmt', 'rgba',
+            '-video_size', f'{self.width}x{self.height}',
+            '-i', self.mask_path,
+            '-filter_complex', f'[0:v]{scale}[base];[base][1:v]overlay=eof_action=repeat',
+        ]
+
+    def _start_process(self):
+        """Launch FFmpeg and a reader thread that publishes its frames"""
         command = [
             'ffmpeg',
             '-f', 'v4l2',
             '-input_format', 'mjpeg',
             '-video_size', f'{self.width}x{self.height}',
+            *(LOW_LATENCY_INPUT_OPTIONS if self.low_latency else ()),
             '-i', self.device,
-            '-vf', f'scale={self.width}:{self.height}',
+            *self._video_filter(),
             '-c:v', 'mjpeg',
             '-q:v', '5',
+            *(('-flush_packets', '1') if self.low_latency else ()),
             '-f', 'image2pipe',
             '-update', '1',
+            # Machine-readable key=value progress on stderr instead of the
+            # human status line
+            '-progress', 'pipe:2',
+            '-nostats',
             '-'
         ]
-        
+
         logging.info(f"Starting FFmpeg with command: {' '.join(command)}")
-        
+
+        self.process_started_at = monotonic()
+        self.starts += 1
         self.process = subprocess.Popen(
             command,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            bufsize=10**9
+            # Unbuffered in low-latency mode, so each read returns whatever
+            # FFmpeg has written instead of waiting to fill a chunk
+            bufsize=0 if self.low_latency else 10**9
         )
-        
-        threading.Thread(target=self._log_stderr, daemon=True).start()
-        return self
 
-    def _read_frame(self):
-        header = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
-        footer = b'\r\n'
+        threading.Thread(target=self._log_stderr, args=(self.process,), daemon=True).start()
+        threading.Thread(target=self._read_frames, args=(self.process,),
+                         daemon=True, name="FFmpegReader").start()
+
+    def _read_frames(self, process):
+        """
+        Split FFmpeg's MJPEG output into frames and publish them.
+
+        One reader per process feeds every client through the shared frame
+        state, so viewers are unaffected when the process is replaced.
+        """
         buffer = bytearray()
-        
+        # An unbuffered pipe returns what is available, so larger reads never wait
+        chunk_size = 65536 if self.low_latency else 4096
+
         while not self.stop_event.is_set():
             try:
                 # Read in chunks
-                chunk = self.process.stdout.read(4096)
+                with self.tracer.span('read'):
+                    chunk = process.stdout.read(chunk_size)
                 if not chunk:
                     break
-                    
+
                 buffer.extend(chunk)
-                
+
                 # Look for JPEG end marker
                 while len(buffer) > 2:
                     try:
+                        parsing = monotonic()
                         # Find start marker
                         start = buffer.index(b'\xff\xd8')
                         # Find end marker
                         end = buffer.index(b'\xff\xd9', start) + 2
-                        
+
                         # Extract the frame
-                        frame = buffer[start:end]
+                        frame = bytes(buffer[start:end])
                         # Remove the frame from buffer
                         buffer = buffer[end:]
-                        
-                        # Yield the frame
-                        yield header + frame + footer
-                        
+                        self.tracer.record('parse', parsing, monotonic(), {'bytes': len(frame)})
+
+                        with self.tracer.span('publish'):
+                            self._publish_frame(frame, time())
+
                     except ValueError:
                         # Start or end marker not found
                         break
-                        
+
                 # Keep buffer size reasonable
                 if len(buffer) > 1000000:
                     buffer = buffer[-50000:]
-                    
+
             except Exception as e:
                 logging.error(f"Error reading frame: {str(e)}")
                 break
 
-    def _log_stderr(self):
-        """Log FFmpeg error output"""
-        for line in iter(self.process.stderr.readline, b''):
-            line_text = line.decode().strip()
-            # Only log non-progress lines
-            if not line_text.startswith('frame='):
+    def _log_stderr(self, process):
+        """Log FFmpeg error output and collect its progress reports"""
+        block = {}
+        for line in iter(process.stderr.readline, b''):
+            line_text = line.decode(errors='replace').strip()
+            key, sep, value = line_text.partition('=')
+            if sep and key.isidentifier():
+                block[key] = parse_progress_value(key, value.strip())
+                # Every report ends with progress=continue or progress=end
+                if key == 'progress':
+                    self._update_progress(block)
+                    block = {}
+            else:
                 logging.info(f"FFmpeg: {line_text}")
-    def stop(self):
-        self.stop_event.set()
-        if self.process:
-            self.process.terminate()
-            try:
-                self.process.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                self.process.kill()
-
-def create_app(stream_instance):
-    app = Flask(__name__)
-    
-    def generate_frames():
-        with stream_instance.clients_lock:
-            stream_instance.clients += 1
-            logging.info(f"Client connected. Total clients: {stream_instance.clients}")
-        
-        try:
-            for frame in stream_instance._read_frame():
-                yield frame
-        finally:
-            with stream_instance.clients_lock:
-                stream_instance.clients -= 1
-                logging.info(f"Client disconnected. Remaining clients: {stream_instance.clients}")
-
-    @app.route('/')
-    def index():
-        return """
-        <html>
-            <head>
-                <title>FFmpeg Camera Stream</title>
-                <meta name="viewport" content="width=device-width, initial-scale=1">
-                <style>
-                    body { margin: 0; padding: 0; background: #000; }
-                    .container { 
-                        display: flex;
-                        justify-content: center;
-                        align-items: center;
-                        min-height: 100vh;
-                    }
-                    img { max-width: 100%; height: auto; }
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <img src="/video_feed" alt="Camera Stream" />
-                </div>
-            </body>
-        </html>
+
+    def _update_progress(self, block):
+        """Publish a complete progress report and warn if encoding falls behind"""
+        self.progress = block
+        self.progress_updated = time()
+        speed = block.get('speed')
+        if speed is not None and speed < SLOW_SPEED_THRESHOLD and \
+                monotonic() - self.slow_warned > SLOW_WARNING_INTERVAL:
+            self.slow_warned = monotonic()
+            logging.warning(f"FFmpeg is running slower than real time: speed {speed}x, "
+                            f"{block.get('fps')} fps, {block.get('drop_frames')} dropped, "
+                            f"{block.get('dup_frames')} duplicated")
+
+    def get_stats(self):
+        """Server stats plus FFmpeg's own view of its encoding performance"""
+        stats = super().get_stats()
+        progress = self.progress
+        stats['ffmpeg'] = {
+            'running': self._process_running(),
+            'on_demand': self.on_demand,
+            'starts': self.starts,
+            'unexpected_exits': self.unexpected_exits,
+            'cpu_percent': self.cpu_percent if self._process_running() else None,
+            'rss_bytes': self.rss_bytes if self._process_running() else None,
+            'frame': progress.get('frame'),
+            'fps': progress.get('fps'),
+            'speed': progress.get('speed'),
+            'bitrate_kbps': progress.get('bitrate'),
+            'total_size': progress.get('total_size'),
+            'dup_frames': progress.get('dup_frames'),
+            'drop_frames': progress.get('drop_frames'),
+            'updated': self.progress_updated,
+        }
+        return stats
+
+    def _capture_expected(self):
         """
+        Frames are due while FFmpeg is running. Exits are left to the
+        supervisor and its backoff; the watchdog handles hung processes.
+        """
+        return self._process_running()
 
-    @app.route('/video_feed')
-    def video_feed():
-        return Response(
-            generate_frames(),
-            mimetype='multipart/x-mixed-replace; boundary=frame'
-        )
+    def _restart_pipeline(self):
+        """Replace the FFmpeg process; clients keep the last frame meanwhile"""
+        with self.process_lock:
+            self._terminate_process()
+            self._start_process()
+        logging.info("FFmpeg pipeline rebuilt")
+        return True
+
+    def _terminate_process(self):
+        with self.process_lock:
+            process, self.process = self.process, None
+            if process:
+                process.terminate()
+                try:
+                    process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    def stop(self):
+        self.stop_event.set()
+        self.supervisor_wake.set()
+        self._terminate_process()
+        if self.mask_path is not None:
+            os.unlink(self.mask_path)
+            self.mask_path = None
 
-    return app
+def create_app(stream_instance, admission=None):
+    return create_stream_app(stream_instance, title="FFmpeg Camera Stream", admission=admission)
@@ -1,51 +1,353 @@
 #!/usr/bin/env python3
-import cv2
 import numpy as np
-from flask import Flask, Response
+from flask import Flask, Response, request, jsonify, redirect
 import threading
-from picamera2 import Picamera2
 import logging
 import io
-from time import sleep, time
+import math
+from time import localtime, monotonic, sleep, strftime, time
 import signal
-from .camera_utils import get_camera_index
+import socket
 
-class VideoStream:
-    def __init__(self, width=1280, height=720, framerate=30, format="MJPEG",
-                 brightness=0.0, contrast=1.0, saturation=1.0):
-        self.resolution = (width, height)
+# Camera libraries are only present on the Pi; relays and other frame
+# sources can still use create_app without them
+try:
+    from picamera2 import Picamera2
+except ImportError:
+    Picamera2 = None
+try:
+    from picamera2 import MappedArray
+except ImportError:
+    MappedArray = None
+try:
+    from libcamera import ColorSpace
+except ImportError:
+    ColorSpace = None
+
+from .admission import lower_thread_priority
+from .camera_utils import (get_camera_index, get_camera_roi, get_privacy_masks, load_tuned_profile,
+                           select_sensor_mode)
+from .encode_pool import EncodePool
+from .frame_bus import FrameBusWriter
+from .frame_pool import FramePool
+from .frame_source import FrameSource, sensor_to_wall_clock
+from .jpeg import JPEG_BACKEND, encode_jpeg, pack_yuv420
+from .pipeline import Frame, Pipeline, Stage
+from .privacy import PrivacyMask
+from .roi import RAW_FORMATS, RoiStreams, parse_roi, parse_size, roi_to_scaler_crop
+
+# Seconds between repeats of the last frame when no new frame arrives
+KEEPALIVE_INTERVAL = 1.0
+# Default and longest wait of a /frames/next long-poll, in seconds
+LONG_POLL_TIMEOUT = 10.0
+MAX_LONG_POLL_TIMEOUT = 30.0
+# Frame URLs never change content, so caches may keep them for a year
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# A wait for a camera request longer than this many frame intervals is a stall
+STALL_INTERVALS = 2.0
+# Suggest more buffers when this fraction of recent requests stalled
+STALL_WARNING_RATE = 0.05
+# Camera buffers in low-latency mode: one being filled, one being read
+LOW_LATENCY_BUFFER_COUNT = 2
+# Kernel send buffer per client in low-latency mode, about one 720p frame,
+# so a slow client skips to the newest frame instead of queueing old ones
+LOW_LATENCY_SNDBUF = 128 * 1024
+# Longest wait for a free encode slot before a frame is dropped, in seconds
+ENCODE_SUBMIT_TIMEOUT = 1.0
+# First and longest wait between attempts to start the camera in the background, in seconds
+START_RETRY_DELAY = 1.0
+START_MAX_BACKOFF = 30.0
+# Full-resolution stills: pixel format, default JPEG quality, and how long a
+# request waits for the capture thread to take one, in seconds
+STILL_FORMAT = "RGB888"
+STILL_QUALITY = 95
+STILL_TIMEOUT = 10.0
+
+class BufferStats:
+    """Occupancy and stall counters for camera buffers held by the capture loop"""
+
+    def __init__(self, buffer_count):
+        self.buffer_count = buffer_count
         self.lock = threading.Lock()
-        self.frame_buffer = None
-        self.stop_event = threading.Event()
-        self.frame_count = 0
-        self.clients = 0
-        self.clients_lock = threading.Lock()
-        self.framerate = framerate
-        
-        # Get the camera index using our utility function
-        camera_index = get_camera_index()
-        logging.info(f"Using camera at index {camera_index}")
-        self.picam2 = Picamera2(camera_index)
+        self.held = 0
+        self.max_held = 0
+        self.requests = 0
+        self.stalls = 0
+        self.max_wait = 0.0
+        self.hold_total = 0.0
+        self.max_hold = 0.0
+        self.window_requests = 0
+        self.window_stalls = 0
+
+    def acquired(self, waited, stalled):
+        with self.lock:
+            self.held += 1
+            self.max_held = max(self.max_held, self.held)
+            self.requests += 1
+            self.window_requests += 1
+            self.max_wait = max(self.max_wait, waited)
+            if stalled:
+                self.stalls += 1
+                self.window_stalls += 1
+
+    def released(self, held_for):
+        with self.lock:
+            self.held -= 1
+            self.hold_total += held_for
+            self.max_hold = max(self.max_hold, held_for)
+
+    def take_window(self):
+        """Return and reset (requests, stalls) since the last call"""
+        with self.lock:
+            window = (self.window_requests, self.window_stalls)
+            self.window_requests = self.window_stalls = 0
+            return window
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'buffer_count': self.buffer_count,
+                'held': self.held,
+                'max_held': self.max_held,
+                'requests': self.requests,
+                'stalls': self.stalls,
+                'max_wait_ms': round(self.max_wait * 1000, 2),
+                'mean_hold_ms': round(self.hold_total * 1000 / self.requests, 2)
+                if self.requests else None,
+                'max_hold_ms': round(self.max_hold * 1000, 2),
+            }
+
+class VideoStream(FrameSource):
+    def __init__(self, width=1280, height=720, framerate=30, format="YUV420",
+                 brightness=0.0, contrast=1.0, saturation=1.0,
+                 encode_workers=0, encode_quality=85,
+                 frame_bus=None, bus_lores_size=None, roi=None, max_rois=4,
+                 camera_index=None, background_start=False, watchdog_timeout=5.0,
+                 buffer_count=4, sensor_mode=None, tuned_profile=None, overlay=None,
+                 privacy_masks=None, stages=None, low_latency=False):
+        if Picamera2 is None:
+            raise ImportError("picamera2 is required for VideoStream "
+                              "(sudo apt install python3-picamera2)")
+        super().__init__(framerate)
+
+        # Settings chosen by the autotuner replace the arguments they cover;
+        # tuned_profile=False ignores the profile, a path loads another one
+        if tuned_profile is not False:
+            tuned = load_tuned_profile(tuned_profile)
+            if tuned:
+                width = tuned.get('width', width)
+                height = tuned.get('height', height)
+                format = tuned.get('format', format)
+                sensor_mode = tuned.get('sensor_mode', sensor_mode)
+                buffer_count = tuned.get('buffer_count', buffer_count)
+                encode_workers = tuned.get('encode_workers', encode_workers)
+                encode_quality = tuned.get('encode_quality', encode_quality)
+
+        # Low latency keeps the fewest frames in flight anywhere
+        self.low_latency = low_latency
+        if low_latency:
+            buffer_count = min(buffer_count, LOW_LATENCY_BUFFER_COUNT)
+
+        self.resolution = (width, height)
+        # Image widths of the configured streams, read back from the camera
+        self.frame_width = width
+        self.lores_width = bus_lores_size[0] if bus_lores_size else None
+        self.camera_index = camera_index
+        self.controls = (brightness, contrast, saturation)
+        self.camera_controls = {}
+        self.buffer_count = buffer_count
+        self.buffer_stats = BufferStats(buffer_count)
+        self.sensor_mode = sensor_mode
+        self.sensor_mode_info = None
+        # Sensor configuration chosen at startup, reused when recovering
+        self.sensor_config = None
+        self.picam2 = None
+
+        # With encode workers the camera delivers raw frames and JPEG
+        # encoding is spread across processes instead of one core
+        self.encode_workers = encode_workers
+        self.encode_quality = encode_quality
+        self.encode_pool = None
+        self.encode_pool_lock = threading.Lock()
+        if encode_workers and format == "MJPEG":
+            format = "YUV420"
+        # A TextOverlay draws into raw frames before they are encoded; YUV420
+        # lets it touch only the luma plane and feeds libjpeg-turbo directly
+        self.overlay = overlay
+        # Polygons blacked out of every output; None reads them from config.ini
+        if privacy_masks is None:
+            privacy_masks = get_privacy_masks()
+        self.privacy_mask = PrivacyMask(privacy_masks) if privacy_masks else None
+        if (overlay is not None or self.privacy_mask is not None) and format == "MJPEG":
+            format = "YUV420"
+        if self.privacy_mask is not None and format not in RAW_FORMATS:
+            raise ValueError(f"Privacy masks need a raw format, not {format}")
+        self.format = format
+
+        # Optional shared-memory bus for other processes on this host
+        self.frame_bus = frame_bus
+        self.bus_lores_size = bus_lores_size
+        self.lores_bus = None
+
+        # Crops requested per client with /video_feed?roi=
+        self.roi_streams = RoiStreams(quality=encode_quality, max_rois=max_rois)
+        self.initial_roi = roi
+        self.roi = None
+        self.scaler_crop = None
+
+        self.buffer = io.BytesIO()
+        # Raw frame arrays, sized to what the pipeline can hold when it starts
+        self.frame_pool = FramePool()
+
+        # Everything between capture and publish is a pipeline stage; extra
+        # stages from ``stages`` or add_stage() run just before encoding
+        self.pipeline = Pipeline(sink=self._publish_pipeline_frame, timings=self.stage_timings,
+                                 tracer=self.tracer)
+        if self.privacy_mask is not None:
+            self.pipeline.add(Stage('privacy', self._mask_frame))
+        if overlay is not None:
+            self.pipeline.add(Stage('overlay', self._overlay_frame))
+        self.pipeline.add(Stage('encode', self._encode_frame))
+        # A tap, so a failing ROI crop never costs main-stream viewers a frame
+        self.pipeline.add(Stage('roi', self._render_rois, tap=True))
+        for stage in stages or ():
+            self.add_stage(stage)
+
+        # Each rebuild of the pipeline starts a new capture thread; older
+        # threads that were stuck in a capture exit when they wake up
+        self.capture_generation = 0
+        self.initial_watchdog_timeout = watchdog_timeout
+
+        # Full-resolution stills are taken by the capture thread between two
+        # video frames, so the camera is only ever driven from one thread
+        self.still_lock = threading.Lock()
+        self.still_job = None
+        self.still_in_progress = False
+        self.still_stats = {'count': 0, 'failures': 0, 'last_switch_ms': None,
+                            'last_gap_ms': None, 'max_gap_ms': None}
+        self.last_capture_monotonic = None
+
+        # In background mode the camera is opened by start() on its own
+        # thread, so the web server can come up while libcamera initialises
+        self.background_start = background_start
+        if not background_start:
+            self._open_camera()
+
+    def _open_camera(self, recovering=False):
+        """
+        Find, open and configure the camera, timing each phase.
+
+        When ``recovering`` the camera is reopened as it was left: the sensor
+        mode chosen at startup and the current ROI are kept, and the startup
+        timings are not overwritten.
+        """
+        started = time()
+        if self.camera_index is None:
+            # Get the camera index using our utility function
+            self.camera_index = get_camera_index()
+        if not recovering:
+            self._record_startup('discover', started)
+        logging.info(f"Using camera at index {self.camera_index}")
+
+        started = time()
+        self.picam2 = Picamera2(self.camera_index)
+        if not recovering:
+            self._record_startup('init', started)
         
+        started = time()
         try:
             # Simple configuration without problematic controls
+            streams = {"main": {"size": self.resolution, "format": self.format}}
+            if self.frame_bus and self.bus_lores_size:
+                streams["lores"] = {"size": self.bus_lores_size, "format": "YUV420"}
+            if not recovering:
+                self.sensor_config = self._choose_sensor_mode()
+            sensor = self.sensor_config
+            if sensor is not None:
+                streams["sensor"] = sensor
+            if self.format == "YUV420" and ColorSpace is not None:
+                # Full-range YCbCr, as JPEG expects, so the planes can be
+                # encoded directly without a range conversion
+                streams["colour_space"] = ColorSpace.Sycc()
+            if self.low_latency:
+                # The sensor paces frames at the requested rate, and no
+                # completed frame is held back for the next capture
+                frame_us = int(1e6 / self.framerate)
+                streams["controls"] = {"FrameDurationLimits": (frame_us, frame_us)}
+                streams["queue"] = False
             config = self.picam2.create_video_configuration(
-                main={"size": self.resolution, "format": format},
-                buffer_count=4
+                **streams,
+                buffer_count=self.buffer_count
             )
             
             # Configure the camera
             self.picam2.configure(config)
+            # YUV420 rows can be padded beyond the image; frames are copied
+            # out without the padding, so later stages never see it
+            self.frame_width = self._stream_width("main", self.resolution[0])
+            if "lores" in streams:
+                self.lores_width = self._stream_width("lores", self.bus_lores_size[0])
             
             # Apply camera controls after configuration
-            self.set_camera_properties(brightness, contrast, saturation)
+            self.set_camera_properties(*self.controls)
+
+            # Masks are fractions of the full field of view, like ROIs, and
+            # are mapped to each frame's ScalerCrop as it is masked
+            if self.privacy_mask is not None:
+                self.privacy_mask.sensor_area = \
+                    self.picam2.camera_properties.get('ScalerCropMaximum')
+
+            # Camera-wide ROI is cropped by the ISP before scaling and encoding
+            if recovering:
+                if self.scaler_crop is not None:
+                    self.set_roi(self.roi)
+            else:
+                roi = self.initial_roi
+                if roi is None:
+                    roi = get_camera_roi()
+                if roi is not None:
+                    self.set_roi(roi)
             
-            self.buffer = io.BytesIO()
             logging.info("Camera configuration complete")
         except Exception as e:
             logging.error(f"Error configuring camera: {e}")
             raise
+        if not recovering:
+            self._record_startup('configure', started)
             
+    def _choose_sensor_mode(self):
+        """
+        Sensor configuration for the stream, or None to leave it to libcamera.
+
+        ``sensor_mode`` pins a mode by its index in picam2.sensor_modes,
+        False leaves the choice to libcamera, and None (the default) picks
+        the mode matching the resolution and frame rate.
+        """
+        if self.sensor_mode is False:
+            return None
+        try:
+            modes = self.picam2.sensor_modes
+        except Exception as e:
+            logging.warning(f"Could not list sensor modes: {e}")
+            return None
+        index = self.sensor_mode
+        if index is None:
+            index = select_sensor_mode(modes, self.resolution, self.framerate)
+            if index is None:
+                return None
+        mode = modes[index]
+        width, height = mode['size']
+        fps = mode['fps']
+        self.sensor_mode_info = {'index': index, 'size': [width, height],
+                                 'bit_depth': mode.get('bit_depth'), 'max_fps': fps,
+                                 'automatic': self.sensor_mode is None}
+        logging.info(f"Sensor mode {index}{' (automatic)' if self.sensor_mode is None else ''}: "
+                     f"{width}x{height} {mode.get('bit_depth')}-bit, up to {fps:.1f} fps")
+        if fps < self.framerate:
+            logging.warning(f"Sensor mode {index} reaches only {fps:.1f} fps, "
+                            f"below the requested {self.framerate}")
+        return {"output_size": mode["size"], "bit_depth": mode["bit_depth"]}
+
     def set_camera_properties(self, brightness, contrast, saturation):
         """
         Set camera properties safely using v4l2 controls if available
@@ -85,80 +387,518 @@ class VideoStream:
             if controls:
                 logging.info(f"Applying camera controls: {controls}")
                 self.picam2.set_controls(controls)
+                self.camera_controls = controls
                 
         except Exception as e:
             logging.warning(f"Error setting camera properties: {e}")
         
+    def set_roi(self, roi):
+        """
+        Crop the whole camera view to a region of interest using ScalerCrop.
+
+        ``roi`` is an (x, y, w, h) tuple or "x,y,w,h" string of fractions of
+        the full sensor area, or None to restore the full view. The ISP crops
+        and scales, so the main stream keeps its resolution at no extra cost.
+        Privacy masks follow the crop, so they stay on the same part of the scene.
+        """
+        if isinstance(roi, str):
+            roi = parse_roi(roi)
+        crop_maximum = self.picam2.camera_properties.get('ScalerCropMaximum')
+        if crop_maximum is None:
+            logging.warning("Camera does not report ScalerCropMaximum; ROI not applied")
+            return
+        crop = roi_to_scaler_crop(roi or (0.0, 0.0, 1.0, 1.0), crop_maximum)
+        self.picam2.set_controls({"ScalerCrop": crop})
+        self.roi = roi
+        self.scaler_crop = crop
+        logging.info(f"Camera ROI set to {roi} (ScalerCrop {crop})")
+
     def start(self):
-        """Start the video streaming thread"""
+        """
+        Start the video streaming thread.
+
+        With background_start the camera is brought up on a separate thread
+        and this returns immediately; clients that connect meanwhile wait
+        for the first frame. A failed start is retried there with backoff.
+        """
+        if self.background_start:
+            self.startup_thread = threading.Thread(target=self._start_in_background,
+                                                   daemon=True,
+                                                   name="CameraStartup")
+            self.startup_thread.start()
+            return self
+        return self if self._start_camera() else None
+
+    def _start_in_background(self):
+        """
+        Start the camera, retrying with exponential backoff until it starts
+        or the stream is stopped. Nobody is left waiting on start()'s result,
+        so giving up would leave the server up with no camera behind it.
+        """
+        delay = START_RETRY_DELAY
+        while not self._start_camera():
+            self._release_camera()
+            logging.warning(f"Camera did not start; retrying in {delay:.0f}s")
+            if self.stop_event.wait(delay):
+                return
+            delay = min(delay * 2, START_MAX_BACKOFF)
+
+    def _release_camera(self):
+        """Stop and close the camera, so the next start opens it afresh"""
+        camera, self.picam2 = self.picam2, None
+        if camera is None:
+            return
+        for action in (camera.stop, camera.close):
+            try:
+                action()
+            except Exception as e:
+                logging.warning(f"Error releasing camera: {e}")
+
+    def _start_camera(self):
+        """Open the camera if needed, capture the first frame and start capturing"""
         try:
+            if self.picam2 is None:
+                self._open_camera()
+            if self.frame_bus and self.jpeg_bus is None:
+                self._open_frame_bus()
+            if not self.pipeline.started:
+                self.frame_pool.size = self.pipeline.capacity() + 1
+                self.pipeline.start()
+
+            started = time()
             self.picam2.start()
+            self._record_startup('start', started)
+
+            started = time()
             success = self._capture_single_frame()
+            self._record_startup('first_frame', started)
             
             if not success:
                 logging.error("Failed to capture initial frame")
-                return None
+                return False
                 
-            self.capture_thread = threading.Thread(target=self._capture_frames, 
-                                               daemon=True, 
-                                               name="CaptureThread")
-            self.capture_thread.start()
+            self._start_capture_thread()
+            if self.initial_watchdog_timeout:
+                self.start_watchdog(self.initial_watchdog_timeout)
+            self._record_startup('total', self.created_at)
             logging.info("Video stream started successfully")
-            return self
+            logging.info("Startup timing: " + ", ".join(
+                f"{phase} {seconds:.3f}s" for phase, seconds in self.startup_timings.items()))
+            return True
         except Exception as e:
             logging.error(f"Error starting camera: {e}")
-            return None
+            return False
         
+    def _start_capture_thread(self):
+        """Start a capture loop for the current pipeline generation"""
+        self.capture_thread = threading.Thread(target=self._capture_frames,
+                                               args=(self.capture_generation,),
+                                               daemon=True, 
+                                               name="CaptureThread")
+        self.capture_thread.start()
+
+    def _capture_expected(self):
+        """
+        Frames are due whenever someone is watching, polling or reading the
+        bus. Bus readers are invisible to us, so a bus keeps the camera
+        running, unless it feeds HTTP workers that report their viewers.
+        """
+        if self.still_in_progress:
+            return False  # Switched to still mode; no video frames until it switches back
+        return self.has_viewers() or (self.jpeg_bus is not None and self.shared_viewers is None)
+
+    def _restart_pipeline(self):
+        """
+        Close and reopen the camera and start a fresh capture thread.
+
+        Works even if the old capture thread is blocked inside libcamera:
+        it is abandoned and exits on its own if it ever returns. Clients
+        stay connected to the unchanged frame state throughout.
+        """
+        self.capture_generation += 1
+        self._release_camera()
+        self._check_encode_pool()
+        self._open_camera(recovering=True)
+        self.picam2.start()
+        self._start_capture_thread()
+        logging.info("Capture pipeline rebuilt")
+        return True
+
     def _capture_single_frame(self):
         """Capture a single frame"""
         try:
-            self.buffer.seek(0)
-            self.buffer.truncate()
-            self.picam2.capture_file(self.buffer, format='jpeg')
-            self.frame_buffer = self.buffer.getvalue()
+            self._capture_frame()
             return True
         except Exception as e:
             logging.error(f"Error capturing initial frame: {str(e)}")
             return False
+
+    def _create_first_encode_pool(self, array):
+        """Start the encode workers with slots the size of ``array``"""
+        with self.encode_pool_lock:
+            if self.encode_pool is None:
+                self.encode_pool = self._create_encode_pool(array.shape, array.dtype)
+
+    def _check_encode_pool(self):
+        """Replace the encode pool if a worker has died, e.g. killed by the OOM killer"""
+        with self.encode_pool_lock:
+            pool = self.encode_pool
+            if pool is None or pool.alive:
+                return
+            logging.warning("An encode worker has died; restarting the encode pool")
+            self.encode_pool = self._create_encode_pool(pool.shape, pool.dtype)
+        # A killed worker can leave the task queue locked, so closing waits on
+        # joins; do it off the capture thread
+        threading.Thread(target=pool.close, daemon=True, name="EncodePoolClose").start()
+
+    def _create_encode_pool(self, shape, dtype):
+        return EncodePool(shape, dtype,
+                          workers=self.encode_workers,
+                          slots=self.encode_workers if self.low_latency else None,
+                          pixel_format=self.format,
+                          quality=self.encode_quality,
+                          on_frame=self._on_encoded_frame,
+                          tracer=self.tracer)
+
+    def _open_frame_bus(self):
+        """Create the shared-memory segments other local processes read from"""
+        width, height = self.resolution
+        self.jpeg_bus = FrameBusWriter(f"{self.frame_bus}-jpeg", slot_size=width * height)
+        if self.bus_lores_size:
+            lores_width, lores_height = self.bus_lores_size
+            self.lores_bus = FrameBusWriter(f"{self.frame_bus}-lores",
+                                            slot_size=lores_width * lores_height * 3 // 2)
+
+    def _capture_frame(self):
+        """
+        Capture one frame and run it through the processing pipeline.
+
+        Raw pixels are copied out of the request and the buffer is returned
+        to the camera before any processing, so a slow stage cannot starve
+        the ISP of buffers. Only ``MJPEG`` is saved, and so encoded, from the
+        request while it is held, which is why raw YUV420 is the default.
+        Raw frames go into arrays reused from the frame pool, and the JPEG
+        buffer is overwritten rather than truncated, so a steady stream
+        allocates nothing but each frame's final JPEG bytes.
+        """
+        array = None
+        buffer = None
+        started = monotonic()
+        request, acquired = self._capture_request()
+        try:
+            metadata = request.get_metadata()
+            if self.lores_bus is not None:
+                lores = self._unpadded(request.make_array("lores"), self.lores_width)
+                if self.privacy_mask is not None:
+                    self.privacy_mask.apply(lores, "YUV420", self._frame_crop(metadata))
+                self.lores_bus.publish(lores)
+            if self.format in RAW_FORMATS:
+                if MappedArray is not None:
+                    with MappedArray(request, "main") as mapped:
+                        buffer = self._pooled_copy(mapped.array)
+                    array = buffer.array
+                else:
+                    array = request.make_array("main")
+                    if self.format == "YUV420":
+                        array = self._unpadded(array, self.frame_width)
+            else:
+                self.buffer.seek(0)
+                request.save("main", self.buffer, format='jpeg')
+                length = self.buffer.tell()
+        finally:
+            self._release_request(request, acquired)
+        timestamp = self._capture_timestamp(metadata)
+        captured = monotonic()
+        self.last_capture_monotonic = captured
+        self.stage_timings.record('capture', captured - started)
+        self.tracer.record('capture', started, captured)
+
+        jpeg_data = None
+        if array is None:
+            with self.buffer.getbuffer() as view:
+                jpeg_data = bytes(view[:length])
+        self.pipeline.submit(Frame(array, self.format, timestamp, metadata, jpeg_data, buffer))
+
+    def _stream_width(self, name, default):
+        """Image width of a configured stream, which its array rows may exceed"""
+        try:
+            return self.picam2.camera_config[name]["size"][0]
+        except (KeyError, TypeError):
+            return default
+
+    def _unpadded(self, array, width):
+        """A YUV420 array packed to ``width``, copied only if its rows are padded"""
+        return array if array.shape[1] == width else pack_yuv420(array, width)
+
+    def _pooled_copy(self, array):
+        """Copy a raw camera array into a pooled one, leaving out any row padding"""
+        if self.format == "YUV420" and array.shape[1] != self.frame_width:
+            buffer = self.frame_pool.acquire((array.shape[0], self.frame_width), array.dtype)
+            pack_yuv420(array, self.frame_width, buffer.array)
+        else:
+            buffer = self.frame_pool.acquire(array.shape, array.dtype)
+            np.copyto(buffer.array, array)
+        return buffer
+
+    def capture_still(self, quality=STILL_QUALITY, timeout=STILL_TIMEOUT):
+        """
+        Capture a full-resolution JPEG without stopping the stream.
+
+        The capture thread switches the camera to a still configuration, takes
+        one frame and switches straight back, so the video pauses for a single
+        mode switch. Viewers keep receiving the last frame meanwhile. The
+        still shows the stream's field of view, including any ROI, at the
+        sensor's native resolution. Privacy masks are mapped to that crop and
+        applied, with the overlay, in the calling thread after video resumes.
+
+        Returns ``(jpeg, timestamp, gap)``; ``gap`` is the seconds from the
+        last video frame before the switch to the first one after, or None
+        if no video was being captured. Raises RuntimeError if the camera is
+        not open or another still is in progress, TimeoutError if the
+        capture thread does not take the still within ``timeout`` seconds.
+        """
+        if not self.still_lock.acquire(blocking=False):
+            raise RuntimeError("Another still capture is in progress")
+        try:
+            if self.picam2 is None:
+                raise RuntimeError("Camera is not open")
+            job = {'done': threading.Event()}
+            self.still_job = job
+            if not job['done'].wait(timeout):
+                self.still_job = None
+                raise TimeoutError(f"No still captured within {timeout:.0f}s")
+        finally:
+            self.still_lock.release()
+        if 'error' in job:
+            raise job['error']
+
+        array = job['array']
+        if self.privacy_mask is not None:
+            self.privacy_mask.apply(array, STILL_FORMAT, job['crop'])
+        if self.overlay is not None:
+            self.overlay.apply(array, STILL_FORMAT, job['timestamp'])
+        jpeg_data = encode_jpeg(array, STILL_FORMAT, quality)
+        if jpeg_data is None:
+            raise RuntimeError("Failed to encode still")
+        return jpeg_data, job['timestamp'], job['gap']
+
+    def _take_still(self, job):
+        """Switch to full resolution for one frame and back; runs on the capture thread"""
+        before = self.last_capture_monotonic
+        self.still_in_progress = True
+        started = monotonic()
+        try:
+            # Ask for the stream's crop explicitly, at one output pixel per
+            # sensor pixel, so the still never shows more than viewers see
+            # and the privacy mask can be mapped to it exactly
+            crop = self.scaler_crop or self.picam2.camera_properties.get('ScalerCropMaximum')
+            controls = dict(self.camera_controls)
+            width, height = self.picam2.sensor_resolution
+            if crop is not None:
+                controls["ScalerCrop"] = crop
+                width, height = min(crop[2], width), min(crop[3], height)
+            config = self.picam2.create_still_configuration(
+                main={"size": (width & ~1, height & ~1), "format": STILL_FORMAT},
+                controls=controls)
+            job['crop'] = crop
+            job['array'] = self.picam2.switch_mode_and_capture_array(config, "main")
+            job['timestamp'] = time()
+        except Exception as e:
+            logging.error(f"Error capturing still: {e}")
+            job['error'] = e
+        finally:
+            self.still_in_progress = False
+            self._restore_controls()
+        switched = monotonic()
+        self.tracer.record('still', started, switched)
+
+        # Resume video at once instead of after the loop's sleep, and time
+        # the gap viewers saw from the last frame before to the first after
+        gap = None
+        try:
+            if 'error' not in job and before is not None and self._capture_expected():
+                self._capture_frame()
+                gap = self.last_capture_monotonic - before
+        finally:
+            stats = self.still_stats
+            if 'error' in job:
+                stats['failures'] += 1
+            else:
+                stats['count'] += 1
+                stats['last_switch_ms'] = round((switched - started) * 1000, 1)
+                if gap is not None:
+                    stats['last_gap_ms'] = round(gap * 1000, 1)
+                    stats['max_gap_ms'] = max(stats['max_gap_ms'] or 0, stats['last_gap_ms'])
+                height, width = job['array'].shape[:2]
+                logging.info(f"Captured {width}x{height} still: mode switch "
+                             f"{stats['last_switch_ms']} ms, stream gap "
+                             f"{'none' if gap is None else f'{gap * 1000:.1f} ms'}")
+            job['gap'] = gap
+            job['done'].set()
+
+    def _restore_controls(self):
+        """Reapply the controls set at runtime, which a mode switch resets"""
+        controls = dict(self.camera_controls)
+        if self.scaler_crop is not None:
+            controls["ScalerCrop"] = self.scaler_crop
+        if controls:
+            try:
+                self.picam2.set_controls(controls)
+            except Exception as e:
+                logging.warning(f"Could not restore camera controls: {e}")
+
+    def add_stage(self, stage, before='encode'):
+        """
+        Add a processing Stage to the pipeline; call before start().
+
+        By default it runs after privacy masking and the overlay, on raw
+        frames just before they are encoded.
+        """
+        self.pipeline.add(stage, before)
+
+    def _frame_crop(self, metadata):
+        """The ScalerCrop a frame shows: from its metadata, else the one last set"""
+        if isinstance(metadata, dict) and metadata.get('ScalerCrop'):
+            return metadata['ScalerCrop']
+        return self.scaler_crop
+
+    def _mask_frame(self, frame):
+        if frame.array is not None:
+            self.privacy_mask.apply(frame.array, frame.pixel_format,
+                                    self._frame_crop(frame.metadata))
+        return frame
+
+    def _overlay_frame(self, frame):
+        if frame.array is not None:
+            self.overlay.apply(frame.array, frame.pixel_format, frame.timestamp)
+        return frame
+
+    def _encode_frame(self, frame):
+        """Encode raw pixels, or hand them to the encode pool, which publishes them"""
+        if frame.array is None:
+            return frame
+        if self.encode_workers:
+            if self.stop_event.is_set():
+                return None
+            # The workers are sized for the first frame that reaches them; a
+            # frame held by a dead worker would block every later one, so
+            # replace the pool first, and never wait for a slot indefinitely
+            if self.encode_pool is None:
+                self._create_first_encode_pool(frame.array)
+            else:
+                self._check_encode_pool()
+            if self.encode_pool.submit(frame.array, frame.timestamp,
+                                       timeout=ENCODE_SUBMIT_TIMEOUT) is None:
+                logging.warning(f"No encode slot free for {ENCODE_SUBMIT_TIMEOUT}s; frame dropped")
+                return None
+            return frame
+        frame.jpeg = self._encode_jpeg(frame.array)
+        if frame.jpeg is None:
+            logging.warning("Failed to encode frame")
+            return None
+        return frame
+
+    def _render_rois(self, frame):
+        """Crop ROI sub-streams before the publish wakes the clients watching them"""
+        if self.roi_streams.active:
+            self.roi_streams.render(frame.timestamp, frame.array, frame.pixel_format, frame.jpeg)
+        return frame
+
+    def _publish_pipeline_frame(self, frame):
+        if frame.jpeg is not None:
+            self._publish_frame(frame.jpeg, frame.timestamp)
+
+    def _capture_request(self):
+        """Wait for the next completed request, counting waits long enough to be stalls"""
+        started = monotonic()
+        request = self.picam2.capture_request()
+        acquired = monotonic()
+        self.buffer_stats.acquired(acquired - started,
+                                   acquired - started > STALL_INTERVALS / self.framerate)
+        if self.buffer_stats.window_requests >= 300:
+            requests, stalls = self.buffer_stats.take_window()
+            if stalls > requests * STALL_WARNING_RATE:
+                logging.warning(f"{stalls} of the last {requests} camera requests stalled; "
+                                f"consider a higher buffer_count than {self.buffer_count} "
+                                f"or run picamera2_webstream.autotune")
+        return request, acquired
+
+    def _release_request(self, request, acquired):
+        """Return a request's buffers to the camera"""
+        request.release()
+        self.buffer_stats.released(monotonic() - acquired)
+
+    def _encode_jpeg(self, array):
+        """JPEG-encode a raw frame in this thread; None if encoding failed"""
+        return encode_jpeg(array, self.format, self.encode_quality)
+
+    def get_stats(self):
+        """Stream stats plus camera buffer occupancy, stalls and frame pool reuse"""
+        stats = super().get_stats()
+        stats['buffers'] = self.buffer_stats.as_dict()
+        stats['frame_pool'] = self.frame_pool.as_dict()
+        stats['sensor_mode'] = self.sensor_mode_info
+        stats['stills'] = dict(self.still_stats)
+        stats['jpeg_encoder'] = JPEG_BACKEND if self.format in RAW_FORMATS else 'picamera2'
+        return stats
+
+    def _capture_timestamp(self, metadata):
+        """Wall-clock capture time from request metadata, or now if unavailable"""
+        if isinstance(metadata, dict) and 'SensorTimestamp' in metadata:
+            return sensor_to_wall_clock(metadata['SensorTimestamp'])
+        return time()
+
+    def _on_encoded_frame(self, seq, jpeg_data, timestamp):
+        """Receive frames from the encode pool, already in capture order"""
+        with self.tracer.span('publish', seq=seq):
+            self._publish_frame(jpeg_data, timestamp)
         
     def stop(self):
         """Stop the video streaming"""
         self.stop_event.set()
-        if hasattr(self, 'picam2'):
+        if self.encode_pool is not None:
+            try:
+                self.encode_pool.close()
+            except Exception as e:
+                logging.error(f"Error stopping encode pool: {e}")
+        if self.picam2 is not None:
             try:
                 self.picam2.stop()
             except Exception as e:
                 logging.error(f"Error stopping camera: {e}")
+        if hasattr(self, 'capture_thread'):
+            self.capture_thread.join(timeout=2)
+        self.pipeline.stop()
+        for bus in (self.jpeg_bus, self.lores_bus):
+            if bus is not None:
+                bus.close()
         
-    def _capture_frames(self):
+    def _capture_frames(self, generation=0):
         """Continuously capture frames from the camera"""
         frame_interval = 1/self.framerate
         retries = 0
         max_retries = 3
 
-        while not self.stop_event.is_set():
+        while not self.stop_event.is_set() and generation == self.capture_generation:
             try:
                 start_time = time()
 
-                # Only capture if we have clients or no frame
-                if self.clients > 0 or self.frame_buffer is None:
-                    self.buffer.seek(0)
-                    self.buffer.truncate()
-
-                    self.picam2.capture_file(self.buffer, format='jpeg')
-                    jpeg_data = self.buffer.getvalue()
-
-                    with self.lock:
-                        self.frame_buffer = jpeg_data
+                # A still requested over HTTP is taken between two frames
+                job, self.still_job = self.still_job, None
+                if job is not None:
+                    self._take_still(job)
 
-                    if self.frame_count % 300 == 0:
-                        logging.info(f"Stream stats - Frame: {self.frame_count}, "
-                                     f"Size: {len(jpeg_data)} bytes, "
-                                     f"Clients: {self.clients}")
-                    self.frame_count += 1
+                # Only capture if we have clients or no frame
+                captured = False
+                if self._capture_expected() or self.frame_buffer is None:
+                    self._capture_frame()
+                    captured = True
                     retries = 0  # Reset retries on success
 
-                # Maintain frame rate
+                # Maintain frame rate. In low-latency mode the sensor paces
+                # captures, and sleeping would only leave new frames waiting.
+                if captured and self.low_latency:
+                    continue
                 elapsed = time() - start_time
                 sleep_time = max(0, frame_interval - elapsed)
                 if sleep_time > 0:
@@ -168,56 +908,276 @@ class VideoStream:
                 logging.error(f"Runtime error during capture: {e}")
                 retries += 1
                 if retries >= max_retries:
-                    logging.error("Max retries exceeded. Restarting camera...")
-                    try:
-                        self.picam2.stop()
-                        sleep(1)  # Wait before restarting
-                        self.picam2.start()
-                        retries = 0
-                    except Exception as restart_error:
-                        logging.error(f"Error restarting camera: {restart_error}")
-                        sleep(5)  # Give more time before next attempt
+                    # Rebuilding starts a new capture thread, so this one
+                    # ends. Without the watchdog nothing else retries a
+                    # failed rebuild, so keep trying with backoff.
+                    delay = START_RETRY_DELAY
+                    while not self._recover("max retries exceeded"):
+                        logging.warning(f"Pipeline not rebuilt; retrying in {delay:.0f}s")
+                        if self.stop_event.wait(delay) or \
+                                self.capture_thread is not threading.current_thread():
+                            return  # Stopped, or another thread rebuilt it
+                        delay = min(delay * 2, START_MAX_BACKOFF)
+                    return
             except Exception as e:
                 logging.error(f"Unexpected error during capture: {e}")
                 sleep(0.1)
 
-def create_app(stream_instance):
-    """Create and configure the Flask application"""
+def tune_low_latency_socket(sock):
+    """Send each part immediately and keep little queued in the kernel for a client"""
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, LOW_LATENCY_SNDBUF)
+    except (AttributeError, OSError) as e:
+        logging.debug(f"Could not tune client socket: {e}")
+
+
+def parse_positive(text):
+    """Parse a finite number above zero; ValueError for anything else, including nan and inf"""
+    value = float(text)
+    if not math.isfinite(value) or value <= 0:
+        raise ValueError(f"{text} is not a positive number")
+    return value
+
+
+def create_app(stream_instance, title="Pi Camera Stream", admission=None):
+    """
+    Create and configure the Flask application.
+
+    ``admission`` is an optional AdmissionControl limiting /video_feed streams.
+    """
     app = Flask(__name__)
     
-    def generate_frames():
-        """Generator function to yield video frames"""
-        with stream_instance.clients_lock:
-            stream_instance.clients += 1
-            logging.info(f"Client connected. Total clients: {stream_instance.clients}")
-        
-        try:
-            while True:
-                frame_data = None
-                with stream_instance.lock:
-                    if stream_instance.frame_buffer is not None:
-                        frame_data = stream_instance.frame_buffer
-                
-                if frame_data is not None:
-                    yield (b'--frame\r\n'
-                           b'Content-Type: image/jpeg\r\n'
-                           b'Content-Length: ' + str(len(frame_data)).encode() + b'\r\n'
-                           b'\r\n' + frame_data + b'\r\n')
-                
-                sleep(1/stream_instance.framerate)
-                
-        finally:
-            with stream_instance.clients_lock:
-                stream_instance.clients -= 1
-                logging.info(f"Client disconnected. Remaining clients: {stream_instance.clients}")
+    def generate_frames(client, get_frame=stream_instance.latest_frame):
+        """
+        Generator function to yield video frames.
+
+        Waits for each new frame rather than polling, and sends a rate-limited
+        client only the evenly spaced frames it asked for, so any number of
+        different rates share the same captures. Frames are then dropped for
+        clients over their share of the stream's egress limit.
+        """
+        # Serving threads yield the CPU to capture according to priority class
+        if client.priority:
+            lower_thread_priority(client.priority)
+        # In low-latency mode a new client waits for a fresh frame rather
+        # than getting the one cached while nobody was watching
+        source_seq = stream_instance.frame_seq if stream_instance.low_latency else 0
+        sent_seq = None
+        sent_at = 0
+        while True:
+            source_seq = stream_instance.wait_for_frame(source_seq, timeout=KEEPALIVE_INTERVAL)
+            seq, timestamp, frame_data = get_frame()
+
+            if frame_data is None:
+                continue
+            if seq == sent_seq:
+                # Nothing new, e.g. while the pipeline recovers: repeat the
+                # last good frame now and then so connections stay alive
+                if monotonic() - sent_at < KEEPALIVE_INTERVAL:
+                    continue
+            elif not client.wants(timestamp, stream_instance.measured_fps or stream_instance.framerate):
+                continue
+
+            part = (b'--frame\r\n'
+                    b'Content-Type: image/jpeg\r\n'
+                    b'Content-Length: ' + str(len(frame_data)).encode() + b'\r\n'
+                    b'X-Frame-Seq: ' + str(seq).encode() + b'\r\n'
+                    b'X-Capture-Timestamp: ' + f'{timestamp:.6f}'.encode() + b'\r\n'
+                    b'\r\n' + frame_data + b'\r\n')
+            # Over its share of the egress budget this client skips the frame
+            if not stream_instance.allow_frame(client, len(part)):
+                continue
+            sent_seq = seq
+            sent_at = monotonic()
+            client.record(len(part))
+            if 'first_frame_served' not in stream_instance.startup_timings:
+                stream_instance._record_startup('first_frame_served', stream_instance.created_at)
+            # The generator resumes once the server has written the part
+            with stream_instance.tracer.span('send', client=client.id, seq=seq):
+                yield part
 
     @app.route('/video_feed')
     def video_feed():
-        """Route to access the video stream"""
-        return Response(
-            generate_frames(),
+        """
+        Route to access the video stream.
+
+        ?fps=N limits this client's frame rate; ?roi=x,y,w,h crops the view,
+        and with ?size=WxH the crop is scaled down to fit that size.
+        """
+        fps = request.args.get('fps')
+        if fps is not None:
+            try:
+                fps = parse_positive(fps)
+            except ValueError:
+                return Response("fps must be a positive number\n", status=400)
+
+        roi_text = request.args.get('roi')
+        size_text = request.args.get('size')
+        roi = size = None
+        roi_streams = getattr(stream_instance, 'roi_streams', None)
+        if size_text is not None and roi_text is None:
+            return Response("size applies to ROI sub-streams; add ?roi=\n", status=400)
+        if roi_text is not None:
+            if roi_streams is None:
+                return Response("This stream does not support ROI\n", status=400)
+            if not roi_streams.available:
+                return Response("ROI sub-streams need a JPEG encoder "
+                                "(python3-simplejpeg or OpenCV)\n", status=503)
+            try:
+                roi = parse_roi(roi_text)
+                if size_text is not None:
+                    size = parse_size(size_text)
+            except ValueError as e:
+                return Response(f"{e}\n", status=400)
+
+        address = request.remote_addr
+        priority = None
+        if admission is not None:
+            priority = admission.admit(address)
+            if priority is None:
+                return Response("Too many streams, try again later\n", status=503,
+                                headers={'Retry-After': str(admission.retry_after)})
+        if roi is not None and not roi_streams.acquire(roi, size):
+            if admission is not None:
+                admission.release(address)
+            return Response("Too many different ROIs in use\n", status=503)
+
+        client = stream_instance.add_client(address, fps, roi_text, priority)
+
+        def roi_frame():
+            # Numbered like the frame it was cropped from, once that is published
+            timestamp, frame_data = roi_streams.latest(roi, size)
+            seq = stream_instance.seq_at(timestamp) if timestamp is not None else None
+            return (seq, timestamp, frame_data) if seq is not None else (0, None, None)
+
+        get_frame = stream_instance.latest_frame if roi is None else roi_frame
+        response = Response(
+            generate_frames(client, get_frame),
             mimetype='multipart/x-mixed-replace; boundary=frame'
         )
+        if stream_instance.low_latency:
+            # Werkzeug's server exposes the client socket; other servers
+            # need TCP_NODELAY set in their own configuration
+            sock = request.environ.get('werkzeug.socket')
+            if sock is not None:
+                tune_low_latency_socket(sock)
+            # Keep nginx and similar proxies from buffering the stream
+            response.headers['X-Accel-Buffering'] = 'no'
+            response.headers['Cache-Control'] = 'no-cache, no-store'
+        # Runs even if the client leaves before the first frame is sent
+        response.call_on_close(lambda: stream_instance.remove_client(client))
+        if roi is not None:
+            response.call_on_close(lambda: roi_streams.release(roi, size))
+        if admission is not None:
+            response.call_on_close(lambda: admission.release(address))
+        return response
+
+    def frame_redirect(seq):
+        """Redirect to the immutable URL of a frame; the redirect itself is not cached"""
+        response = redirect(f'/frames/{seq}.jpg?stream={stream_instance.stream_id}', code=302)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    def not_held(message):
+        response = Response(message, status=404)
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    @app.route('/frames/latest')
+    def latest_frame():
+        """Route redirecting to the newest frame"""
+        stream_instance.touch_poll()
+        seq, _, frame_data = stream_instance.latest_frame()
+        if frame_data is None:
+            return not_held("No frame captured yet\n")
+        return frame_redirect(seq)
+
+    @app.route('/frames/next')
+    def next_frame():
+        """
+        Route that long-polls for a frame newer than ?after=SEQ.
+
+        Redirects to the newest frame once there is one, or answers 204
+        after ?timeout= seconds without a new frame.
+        """
+        try:
+            after = int(request.args.get('after', 0))
+            timeout = min(parse_positive(request.args.get('timeout', LONG_POLL_TIMEOUT)),
+                          MAX_LONG_POLL_TIMEOUT)
+        except ValueError:
+            return Response("after must be a frame number and timeout a positive number\n",
+                            status=400)
+        deadline = monotonic() + timeout
+        while True:
+            # Polls keep the producer running only briefly, so renew while waiting
+            stream_instance.touch_poll()
+            remaining = max(0, deadline - monotonic())
+            seq = stream_instance.wait_for_frame(after, timeout=min(1.0, remaining))
+            if seq > after or monotonic() >= deadline:
+                break
+        if seq <= after:
+            return Response(status=204, headers={'Cache-Control': 'no-store'})
+        return frame_redirect(seq)
+
+    @app.route('/frames/<int:seq>.jpg')
+    def frame(seq):
+        """Route serving one recent frame, cacheable forever"""
+        stream_id = request.args.get('stream')
+        held = stream_instance.frame_by_seq(seq)
+        if held is None or (stream_id is not None and stream_id != stream_instance.stream_id):
+            return not_held("Frame is no longer held\n")
+        _, timestamp, frame_data = held
+        response = Response(frame_data, mimetype='image/jpeg')
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.headers['ETag'] = f'"{stream_instance.stream_id}-{seq}"'
+        response.headers['X-Frame-Seq'] = str(seq)
+        response.headers['X-Capture-Timestamp'] = f'{timestamp:.6f}'
+        return response
+
+    @app.route('/capture/full', methods=['GET', 'POST'])
+    def capture_full():
+        """Route capturing a full-resolution JPEG while the stream keeps running"""
+        capture_still = getattr(stream_instance, 'capture_still', None)
+        if capture_still is None:
+            return Response("Full-resolution capture needs the picamera2 backend\n", status=404)
+        try:
+            quality = int(request.args.get('quality', STILL_QUALITY))
+        except ValueError:
+            quality = 0
+        if not 1 <= quality <= 100:
+            return Response("quality must be a number from 1 to 100\n", status=400)
+        try:
+            jpeg_data, timestamp, gap = capture_still(quality)
+        except (RuntimeError, TimeoutError) as e:
+            return Response(f"{e}\n", status=503,
+                            headers={'Retry-After': '1', 'Cache-Control': 'no-store'})
+        response = Response(jpeg_data, mimetype='image/jpeg')
+        response.headers['Cache-Control'] = 'no-store'
+        response.headers['Content-Disposition'] = \
+            f'inline; filename="still-{strftime("%Y%m%d-%H%M%S", localtime(timestamp))}.jpg"'
+        response.headers['X-Capture-Timestamp'] = f'{timestamp:.6f}'
+        if gap is not None:
+            response.headers['X-Stream-Gap-Ms'] = f'{gap * 1000:.1f}'
+        return response
+
+    @app.route('/stats')
+    def stats():
+        """Route reporting stream and per-client delivery statistics"""
+        stats = stream_instance.get_stats()
+        if admission is not None:
+            stats['admission'] = admission.as_dict()
+        return jsonify(stats)
+
+    @app.route('/trace')
+    def trace():
+        """Route serving the buffered trace spans as Chrome trace-event JSON"""
+        if not stream_instance.tracer.enabled:
+            return Response("Tracing is disabled\n", status=404)
+        response = jsonify(stream_instance.tracer.chrome_trace())
+        response.headers['Content-Disposition'] = 'attachment; filename="trace.json"'
+        response.headers['Cache-Control'] = 'no-store'
+        return response
 
     @app.route('/')
     def index():
@@ -225,7 +1185,7 @@ def create_app(stream_instance):
         return """
         <html>
             <head>
-                <title>Pi Camera Stream</title>
+                <title>""" + title + """</title>
                 <meta name="viewport" content="width=device-width, initial-scale=1">
                 <style>
                     body { margin: 0; padding: 0; background: #000; }
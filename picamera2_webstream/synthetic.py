@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+import threading
+from time import monotonic, sleep, time
+
+from .frame_pool import FramePool
+from .frame_source import FrameSource
+from .jpeg import encode_jpeg
+from .pipeline import Frame, Pipeline, Stage
+
+
+class SyntheticStream(FrameSource):
+    """
+    Moving test pattern captured into pooled YUV420 arrays.
+
+    Frames go through the same FramePool, Pipeline and JPEG encoder as the
+    camera stream, so tests and soak runs exercise the real frame path
+    without a camera.
+    """
+
+    def __init__(self, width=1280, height=720, framerate=30, quality=85):
+        super().__init__(framerate)
+        self.shape = (height * 3 // 2, width)
+        self.quality = quality
+        self.frame_pool = FramePool()
+        self.pipeline = Pipeline(sink=lambda frame: self._publish_frame(frame.jpeg, frame.timestamp),
+                                 timings=self.stage_timings, tracer=self.tracer)
+        self.pipeline.add(Stage('encode', self._encode))
+        self.frame_pool.size = self.pipeline.capacity() + 1
+
+    def _encode(self, frame):
+        frame.jpeg = encode_jpeg(frame.array, "YUV420", self.quality)
+        return frame
+
+    def start(self):
+        self.pipeline.start()
+        self.thread = threading.Thread(target=self._capture, daemon=True, name="Synthetic")
+        self.thread.start()
+        return self
+
+    def _capture(self):
+        interval = 1 / self.framerate
+        next_due = monotonic()
+        captured = 0
+        while not self.stop_event.is_set():
+            buffer = self.frame_pool.acquire(self.shape)
+            # A bar that moves every frame, so each JPEG differs
+            buffer.array.fill(128)
+            x = captured * 8 % self.shape[1]
+            buffer.array[:, x:x + 32] = 235
+            captured += 1
+            self.pipeline.submit(Frame(buffer.array, "YUV420", time(), buffer=buffer))
+            next_due += interval
+            sleep(max(0, next_due - monotonic()))
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join(timeout=2)
+        self.pipeline.stop()
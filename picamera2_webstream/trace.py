@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+import json
+import logging
+import os
+import signal
+import threading
+from collections import deque
+from time import monotonic
+
+# Spans kept in memory; the oldest are overwritten
+TRACE_CAPACITY = 50000
+
+
+class _NullSpan:
+    """Stands in for a span while tracing is off, so disabled spans cost one call"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.started = monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.started, monotonic(), self.args)
+        return False
+
+
+class Tracer:
+    """
+    Timed spans of the frame path in a ring buffer, exported as Chrome
+    trace-event JSON for chrome://tracing or https://ui.perfetto.dev.
+
+    Off until ``enable`` is called. Recording a span is a single deque
+    append of a tuple, with no lock, so tracing can stay on in production.
+    Times are ``time.monotonic`` seconds, which the encode workers share
+    with the server process.
+    """
+
+    def __init__(self, capacity=TRACE_CAPACITY):
+        self.enabled = False
+        self.spans = deque(maxlen=capacity)
+        self.thread_names = {}
+
+    def enable(self, capacity=None):
+        if capacity is not None and capacity != self.spans.maxlen:
+            self.spans = deque(self.spans, maxlen=capacity)
+        self.enabled = True
+        logging.info(f"Tracing enabled, keeping the last {self.spans.maxlen} spans")
+
+    def disable(self):
+        self.enabled = False
+
+    def span(self, name, **args):
+        """Context manager recording the time spent in its block as ``name``"""
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name, args)
+
+    def record(self, name, started, finished, args=None, tid=None, thread_name=None):
+        """
+        Record a span measured by the caller. ``tid`` and ``thread_name``
+        default to the calling thread; pass a worker's pid to place spans
+        from another process on their own track.
+        """
+        if not self.enabled:
+            return
+        if tid is None:
+            tid = threading.get_native_id()
+            if tid not in self.thread_names:
+                self.thread_names[tid] = threading.current_thread().name
+        elif thread_name is not None and tid not in self.thread_names:
+            self.thread_names[tid] = thread_name
+        self.spans.append((name, started, finished, tid, args))
+
+    def chrome_trace(self):
+        """The buffered spans as a Chrome trace-event document"""
+        pid = os.getpid()
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                   'args': {'name': name}}
+                  for tid, name in list(self.thread_names.items())]
+        for name, started, finished, tid, args in list(self.spans):
+            event = {'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+                     'ts': round(started * 1e6, 1),
+                     'dur': round((finished - started) * 1e6, 1)}
+            if args:
+                event['args'] = args
+            events.append(event)
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def dump(self, path):
+        """Write the buffered spans to ``path`` as Chrome trace JSON"""
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        logging.info(f"Wrote {len(self.spans)} trace spans to {path}")
+
+    def dump_on_signal(self, path, signum=signal.SIGUSR1):
+        """Dump to ``path`` whenever the process receives ``signum``; call from the main thread"""
+        def handler(signum, frame):
+            # Written from a thread, so a large dump never blocks the interrupted code
+            threading.Thread(target=self.dump, args=(path,), daemon=True,
+                             name="TraceDump").start()
+        signal.signal(signum, handler)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+import logging
+import multiprocessing
+import os
+import socket
+import struct
+import threading
+from multiprocessing import shared_memory
+from time import monotonic, sleep
+
+from .frame_bus import FrameBusReader, FrameBusWriter
+from .frame_source import POLL_GRACE, FrameSource
+
+# Shared-memory layout of the viewer board:
+#   header: magic, version, slot count
+#   slots:  worker pid, streaming clients, last poll and heartbeat (monotonic)
+# Each worker only ever writes its own slot.
+BOARD_HEADER = struct.Struct('<4sII')
+BOARD_HEADER_SIZE = 16
+BOARD_SLOT = struct.Struct('<QQdd')
+BOARD_MAGIC = b'PCWV'
+BOARD_VERSION = 1
+# Seconds between heartbeats from a worker, and after which a silent worker's viewers expire
+HEARTBEAT_INTERVAL = 1.0
+WORKER_STALE = 5.0
+# JPEG bus slot size when serve_workers creates the bus itself
+WORKER_BUS_SLOT_SIZE = 2 * 1024 * 1024
+
+
+class ViewerBoard:
+    """
+    Viewer counts of the HTTP worker processes, in shared memory.
+
+    Workers write their own slot whenever a client connects, disconnects or
+    polls, and at least every HEARTBEAT_INTERVAL. The capture process adds
+    up the slots whose heartbeat is recent, so a crashed worker's viewers
+    stop keeping the camera running after WORKER_STALE seconds.
+
+    Workers attach with ``create=False``. They are spawned by the creator
+    and share its resource tracker, so the board stays registered there.
+    """
+
+    def __init__(self, name, slots=None, create=False):
+        self.name = name
+        self.created = create
+        if create:
+            size = BOARD_HEADER_SIZE + BOARD_SLOT.size * slots
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            except FileExistsError:
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self.shm.buf[:size] = bytes(size)
+            BOARD_HEADER.pack_into(self.shm.buf, 0, BOARD_MAGIC, BOARD_VERSION, slots)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        magic, version, self.slots = BOARD_HEADER.unpack_from(self.shm.buf, 0)
+        if magic != BOARD_MAGIC or version != BOARD_VERSION:
+            self.close()
+            raise ValueError(f"'{name}' is not a version {BOARD_VERSION} viewer board")
+
+    def update(self, index, clients, last_poll=None):
+        """Publish one worker's streaming clients and last poll time"""
+        BOARD_SLOT.pack_into(self.shm.buf, BOARD_HEADER_SIZE + index * BOARD_SLOT.size,
+                             os.getpid(), clients, last_poll or 0.0, monotonic())
+
+    def workers(self):
+        """(index, pid, clients, last_poll) of every worker with a recent heartbeat"""
+        now = monotonic()
+        live = []
+        for index in range(self.slots):
+            pid, clients, last_poll, heartbeat = BOARD_SLOT.unpack_from(
+                self.shm.buf, BOARD_HEADER_SIZE + index * BOARD_SLOT.size)
+            if pid and now - heartbeat < WORKER_STALE:
+                live.append((index, pid, clients, last_poll))
+        return live
+
+    def active(self):
+        """Whether any worker has a streaming client or a recent poll"""
+        now = monotonic()
+        return any(clients > 0 or (last_poll and now - last_poll < POLL_GRACE)
+                   for _, _, clients, last_poll in self.workers())
+
+    def as_dict(self):
+        workers = self.workers()
+        return {
+            'workers': len(workers),
+            'clients': sum(clients for _, _, clients, _ in workers),
+            'per_worker': {index: clients for index, _, clients, _ in workers},
+        }
+
+    def close(self):
+        """Detach; the process that created the board also removes it"""
+        self.shm.close()
+        if self.created:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class BusStream(FrameSource):
+    """
+    Serve the frames another process publishes to a JPEG frame bus.
+
+    Runs in each HTTP worker. New frames are copied out of shared memory
+    once, however many of the worker's clients are watching, and keep the
+    bus's frame numbers and the capture process's ``stream_id``, so /frames
+    URLs mean the same frame whichever worker answers them.
+    """
+
+    def __init__(self, bus_name, board_name, index, framerate=30, stream_id=None):
+        super().__init__(framerate)
+        if stream_id is not None:
+            self.stream_id = stream_id
+        self.index = index
+        self.reader = FrameBusReader(bus_name, shared_tracker=True)
+        self.board = ViewerBoard(board_name)
+
+    def start(self):
+        self._report()
+        self.reader_thread = threading.Thread(target=self._read_frames, daemon=True,
+                                              name="BusReader")
+        self.reader_thread.start()
+        return self
+
+    def _read_frames(self):
+        seq = 0
+        while not self.stop_event.is_set():
+            self._report()
+            frame = self.reader.wait_for_frame(seq, timeout=HEARTBEAT_INTERVAL)
+            if frame is None:
+                continue
+            data = bytes(frame.data)
+            if not frame.valid():
+                continue  # Overwritten while we copied it
+            seq = frame.seq
+            self._publish_frame(data, frame.timestamp, seq)
+
+    def _clients_changed(self):
+        self._report()
+
+    def _report(self):
+        self.board.update(self.index, self.clients, self.last_poll)
+
+    def get_stats(self):
+        """This worker's stats plus client counts across all workers"""
+        stats = super().get_stats()
+        stats['worker'] = self.index
+        stats['workers'] = self.board.as_dict()
+        return stats
+
+    def stop(self):
+        self.stop_event.set()
+        if hasattr(self, 'reader_thread'):
+            self.reader_thread.join(timeout=2)
+        self.board.update(self.index, 0)
+        self.board.close()
+        self.reader.close()
+
+
+def reuseport_socket(host, port, backlog=128):
+    """
+    A listening socket that other processes can bind to the same port.
+
+    With SO_REUSEPORT the kernel spreads incoming connections across every
+    worker's socket, so no process has to accept on behalf of the others.
+    """
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def _serve_worker(index, host, port, bus_name, board_name, stream_id, framerate, app_factory):
+    """Entry point of an HTTP worker process"""
+    from werkzeug.serving import make_server
+    from .stream_picamera import create_app
+
+    logging.basicConfig(level=logging.INFO,
+                        format=f'%(asctime)s - worker {index} - %(levelname)s - %(message)s')
+    stream = BusStream(bus_name, board_name, index, framerate, stream_id).start()
+    try:
+        app = app_factory(stream) if app_factory is not None else create_app(stream)
+        sock = reuseport_socket(host, port)
+        server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+        logging.info(f"HTTP worker {index} serving on {host}:{port}")
+        server.serve_forever()
+    finally:
+        stream.stop()
+
+
+def serve_workers(source, port=8080, host='0.0.0.0', workers=None, app_factory=None,
+                  bus_name='picamera2-webstream'):
+    """
+    Serve ``source`` from several HTTP worker processes sharing one port.
+
+    This process keeps capturing and publishes every frame to the JPEG
+    frame bus. ``workers`` processes, one per CPU by default, read it and
+    serve clients, each on its own SO_REUSEPORT socket, so serving is not
+    limited by one interpreter's GIL. Their client counts are summed in a
+    ViewerBoard, so the source still only captures while someone watches.
+
+    ``app_factory(stream)`` builds each worker's Flask app; it must be a
+    module-level function, since workers are spawned fresh. Blocks until
+    interrupted or the source is stopped, restarting workers that exit.
+    A bus created here is removed again on return.
+    """
+    created_bus = source.jpeg_bus is None
+    if created_bus:
+        source.jpeg_bus = FrameBusWriter(f"{bus_name}-jpeg", slot_size=WORKER_BUS_SLOT_SIZE)
+    workers = workers or os.cpu_count() or 1
+    board_name = f"{source.jpeg_bus.name}-viewers"
+    board = ViewerBoard(board_name, workers, create=True)
+    source.shared_viewers = board
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = [None] * workers
+
+    def start_worker(index):
+        process = ctx.Process(target=_serve_worker, daemon=True, name=f"HTTPWorker-{index}",
+                              args=(index, host, port, source.jpeg_bus.name, board_name,
+                                    source.stream_id, source.framerate, app_factory))
+        process.start()
+        return process
+
+    logging.info(f"Serving on {host}:{port} from {workers} worker processes")
+    try:
+        while not source.stop_event.is_set():
+            for index, process in enumerate(processes):
+                if process is None or not process.is_alive():
+                    if process is not None:
+                        logging.warning(f"HTTP worker {index} exited with code "
+                                        f"{process.exitcode}; restarting it")
+                    processes[index] = start_worker(index)
+            sleep(HEARTBEAT_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in processes:
+            if process is not None:
+                process.join(timeout=2)
+        source.shared_viewers = None
+        board.close()
+        if created_bus:
+            bus, source.jpeg_bus = source.jpeg_bus, None
+            bus.close()
@@ -0,0 +1,41 @@
+"""Admission control enforces global and per-address limits by priority class."""
+import pytest
+
+from picamera2_webstream.admission import AdmissionControl
+
+
+def test_global_and_per_ip_limits():
+    admission = AdmissionControl(max_clients=3, max_per_ip=2)
+    assert admission.admit('10.0.0.1') == 'normal'
+    assert admission.admit('10.0.0.1') == 'normal'
+    assert admission.admit('10.0.0.1') is None
+    assert admission.admit('10.0.0.2') == 'normal'
+    assert admission.admit('10.0.0.3') is None
+    assert admission.rejected == 2
+    admission.release('10.0.0.1')
+    assert admission.admit('10.0.0.3') == 'normal'
+    assert admission.as_dict()['active'] == 3
+
+
+def test_most_specific_network_wins():
+    admission = AdmissionControl(priorities={'high': ['192.168.1.10/32'],
+                                             'low': ['0.0.0.0/0']})
+    assert admission.classify('192.168.1.10') == 'high'
+    assert admission.classify('192.168.1.11') == 'low'
+    assert admission.classify('::1') == 'normal'
+    assert admission.classify('not an address') == 'normal'
+
+
+def test_high_priority_uses_the_reserve_and_skips_the_per_ip_limit():
+    admission = AdmissionControl(max_clients=1, max_per_ip=1, high_reserve=2,
+                                 priorities={'high': ['10.0.0.9/32']})
+    assert admission.admit('10.0.0.1') == 'normal'
+    assert admission.admit('10.0.0.2') is None
+    assert admission.admit('10.0.0.9') == 'high'
+    assert admission.admit('10.0.0.9') == 'high'
+    assert admission.admit('10.0.0.9') is None
+
+
+def test_unknown_priority_class_is_rejected():
+    with pytest.raises(ValueError):
+        AdmissionControl(priorities={'urgent': ['10.0.0.0/8']})
@@ -0,0 +1,100 @@
+"""Frame bus reads are consistent and readers close while frames are held."""
+import os
+import struct
+
+import numpy as np
+
+from picamera2_webstream.frame_bus import HEADER_SIZE, FrameBusReader, FrameBusWriter
+
+
+def bus_name(tag):
+    return f"pcwb-test-{tag}-{os.getpid()}"
+
+
+def test_close_with_frames_held():
+    writer = FrameBusWriter(bus_name('close'), slot_size=64)
+    try:
+        writer.publish(b'first frame', timestamp=1.0)
+        reader = FrameBusReader(writer.name)
+        frame = reader.read_latest()
+        assert frame.valid()
+        # A worker stopping mid-response still holds the frame it was sending
+        reader.close()
+        assert bytes(frame.data) == b'first frame'
+        assert not frame.valid()
+    finally:
+        writer.close()
+
+
+def test_close_with_array_held():
+    writer = FrameBusWriter(bus_name('array'), slot_size=64)
+    try:
+        writer.publish(np.arange(12, dtype=np.uint8).reshape(3, 4))
+        reader = FrameBusReader(writer.name)
+        array = reader.read_latest().array()
+        reader.close()
+        assert array.sum() == 66
+    finally:
+        del array
+        writer.close()
+
+
+def test_reader_gets_the_newest_frame_once():
+    writer = FrameBusWriter(bus_name('latest'), slot_size=64, slots=4)
+    reader = FrameBusReader(writer.name)
+    try:
+        assert reader.read_latest() is None
+        for n in range(6):
+            writer.publish(b'frame %d' % n, timestamp=float(n))
+        frame = reader.read_latest()
+        assert (frame.seq, frame.timestamp, bytes(frame.data)) == (6, 5.0, b'frame 5')
+        assert reader.read_latest(after_seq=frame.seq) is None
+        del frame
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_overwritten_frame_is_no_longer_valid():
+    writer = FrameBusWriter(bus_name('wrap'), slot_size=64, slots=2)
+    reader = FrameBusReader(writer.name)
+    try:
+        writer.publish(b'old')
+        frame = reader.read_latest()
+        writer.publish(b'newer')
+        assert frame.valid()
+        # The ring wraps onto the old frame's slot
+        writer.publish(b'newest')
+        assert not frame.valid()
+        del frame
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_slot_being_written_is_not_returned():
+    writer = FrameBusWriter(bus_name('odd'), slot_size=64, slots=2)
+    reader = FrameBusReader(writer.name)
+    try:
+        seq = writer.publish(b'frame')
+        offset = HEADER_SIZE + (seq % writer.slots) * writer.stride
+        lock = struct.unpack_from('<Q', writer.buf, offset)[0]
+        # An odd seqlock counter means the writer is mid-write
+        struct.pack_into('<Q', writer.buf, offset, lock + 1)
+        assert reader.read_latest() is None
+        struct.pack_into('<Q', writer.buf, offset, lock)
+        frame = reader.read_latest()
+        assert bytes(frame.data) == b'frame'
+        del frame
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_oversized_frames_are_skipped():
+    writer = FrameBusWriter(bus_name('big'), slot_size=4)
+    try:
+        assert writer.publish(b'too large') is None
+        assert writer.oversized == 1
+    finally:
+        writer.close()
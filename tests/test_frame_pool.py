@@ -0,0 +1,47 @@
+"""Pooled frame arrays are reference counted and reused, with bounded memory."""
+import numpy as np
+import pytest
+
+from picamera2_webstream.frame_pool import FramePool
+
+
+def test_released_arrays_are_reused():
+    pool = FramePool(size=2)
+    first = pool.acquire((4, 4))
+    first.release()
+    again = pool.acquire((4, 4))
+    assert again is first and again.refs == 1
+    assert (pool.allocated, pool.reused) == (1, 1)
+
+
+def test_array_returns_only_after_last_release():
+    pool = FramePool()
+    buffer = pool.acquire((4, 4))
+    buffer.retain()
+    buffer.release()
+    assert pool.free == []
+    buffer.release()
+    assert pool.free == [buffer]
+    with pytest.raises(RuntimeError):
+        buffer.release()
+
+
+def test_pool_keeps_at_most_size_arrays():
+    pool = FramePool(size=2)
+    buffers = [pool.acquire((4, 4)) for _ in range(5)]
+    for buffer in buffers:
+        buffer.release()
+    assert pool.allocated == 5
+    assert len(pool.free) == 2
+
+
+def test_new_shape_empties_the_pool():
+    pool = FramePool()
+    old = pool.acquire((4, 4))
+    old.release()
+    new = pool.acquire((8, 8), np.uint16)
+    assert new is not old and new.array.shape == (8, 8) and new.array.dtype == np.uint16
+    # An array of the old shape coming back late is not kept
+    stale = old.retain()
+    stale.release()
+    assert pool.free == []
@@ -0,0 +1,68 @@
+"""Per-client frame decimation and fair egress shares within the global limit."""
+import pytest
+
+from picamera2_webstream.frame_source import FrameSource
+
+LIMIT = 1000
+
+
+def make_source(demands):
+    source = FrameSource()
+    clients = [source.add_client() for _ in demands]
+    for client, demand in zip(clients, demands):
+        if demand is not None:
+            client.demand = demand
+    source.set_egress_limit(LIMIT)
+    return [client.share for client in clients]
+
+
+@pytest.mark.parametrize('demands', [
+    [None, None, None],
+    [100, None, None],
+    [100, 200, 5000],
+    [2000, 2000, 2000],
+    [0, 10, 20],
+])
+def test_shares_never_exceed_limit(demands):
+    assert sum(make_source(demands)) <= LIMIT + 1e-6
+
+
+def test_fresh_clients_split_equally():
+    assert make_source([None, None, None]) == pytest.approx([LIMIT / 3] * 3)
+
+
+def test_small_demand_is_met_and_rest_shared():
+    small, big, fresh = make_source([100, 5000, None])
+    assert small >= 100
+    assert big == pytest.approx(fresh)
+    assert big == pytest.approx(450)
+
+
+def test_unlimited_clients_have_no_share():
+    source = FrameSource()
+    client = source.add_client()
+    assert client.share is None
+    assert source.allow_frame(client, 10**6)
+
+
+def test_limited_client_gets_evenly_spaced_frames():
+    source = FrameSource(framerate=30)
+    client = source.add_client(fps=10)
+    sent = [n for n in range(30) if client.wants(n / 30, 30)]
+    assert sent == list(range(0, 30, 3))
+
+
+def test_unlimited_or_faster_clients_get_every_frame():
+    source = FrameSource(framerate=30)
+    for fps in (None, 30, 60):
+        client = source.add_client(fps=fps)
+        assert all(client.wants(n / 30, 30) for n in range(30))
+
+
+def test_decimation_restarts_after_a_stall():
+    client = FrameSource().add_client(fps=10)
+    assert client.wants(0.0, 30)
+    # Frames resume after five seconds; the first is sent, with no burst
+    assert client.wants(5.0, 30)
+    assert not client.wants(5.0 + 1 / 30, 30)
+    assert client.wants(5.1, 30)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Memory stays bounded while synthetic frames stream to several clients.
+
+A short version of examples/memory_soak.py; run that for hours-long soaks.
+"""
+import os
+import threading
+import urllib.request
+from time import sleep
+
+import pytest
+from werkzeug.serving import make_server
+
+from picamera2_webstream.jpeg import JPEG_BACKEND
+from picamera2_webstream.procstats import read_process_usage
+from picamera2_webstream.relay import read_multipart
+from picamera2_webstream.stream_picamera import create_app
+from picamera2_webstream.synthetic import SyntheticStream
+
+# Seconds streamed before the RSS baseline, and then measured
+WARMUP = 2.0
+DURATION = 6.0
+# Allowed RSS growth after warm-up
+MAX_GROWTH = 8 * 2**20
+
+
+def read_stream(url, stop_event, counts, index):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        for _ in read_multipart(response):
+            counts[index] += 1
+            if stop_event.is_set():
+                break
+
+
+@pytest.mark.skipif(JPEG_BACKEND is None, reason="no JPEG encoder installed")
+def test_streaming_memory_is_bounded():
+    stream = SyntheticStream(640, 360, framerate=60).start()
+    server = make_server('127.0.0.1', 0, create_app(stream, "Memory test"), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    stop_event = threading.Event()
+    counts = [0] * 3
+    url = f"http://127.0.0.1:{server.server_port}/video_feed"
+    for index in range(len(counts)):
+        threading.Thread(target=read_stream, args=(url, stop_event, counts, index),
+                         daemon=True).start()
+    try:
+        sleep(WARMUP)
+        _, baseline = read_process_usage(os.getpid())
+        allocated = stream.frame_pool.allocated
+        peak = baseline
+        for _ in range(int(DURATION * 2)):
+            sleep(0.5)
+            peak = max(peak, read_process_usage(os.getpid())[1])
+    finally:
+        stop_event.set()
+        server.shutdown()
+        stream.stop()
+
+    assert all(counts), f"every client should receive frames, got {counts}"
+    # Once warm, captures reuse pooled arrays; a burst may add at most a pool-full
+    assert stream.frame_pool.allocated - allocated <= stream.frame_pool.size
+    assert peak - baseline <= MAX_GROWTH, \
+        f"RSS grew by {(peak - baseline) / 2**20:.1f} MB after warm-up"
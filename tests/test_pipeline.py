@@ -0,0 +1,105 @@
+"""Pipeline stages run in order, drop and tap frames, and release every frame once."""
+import threading
+
+import pytest
+
+from picamera2_webstream.frame_pool import FramePool
+from picamera2_webstream.pipeline import Frame, Pipeline, Stage
+
+
+def run(stages, count=1, pool=None):
+    """Submit ``count`` numbered frames and return the numbers that reached the sink"""
+    sunk = []
+    pipeline = Pipeline(stages, sink=lambda frame: sunk.append(frame.data['n'])).start()
+    for n in range(count):
+        buffer = pool.acquire((2, 2)) if pool is not None else None
+        frame = Frame(buffer.array if buffer else None, 'YUV420', float(n), buffer=buffer)
+        frame.data['n'] = n
+        pipeline.submit(frame)
+    return pipeline, sunk
+
+
+def test_stages_run_in_order():
+    order = []
+
+    def step(name):
+        return lambda frame: order.append(name) or frame
+
+    pipeline = Pipeline([Stage('a', step('a')), Stage('c', step('c'))])
+    pipeline.add(Stage('b', step('b')), before='c')
+    pipeline.start().submit(Frame())
+    assert order == ['a', 'b', 'c']
+
+
+def test_dropped_and_failing_frames_never_reach_the_sink():
+    pool = FramePool()
+    drop_odd = Stage('drop', lambda frame: frame if frame.data['n'] % 2 == 0 else None)
+    fail_on_two = Stage('fail', lambda frame: 1 / (frame.data['n'] - 2) and frame)
+    pipeline, sunk = run([drop_odd, fail_on_two], count=6, pool=pool)
+    assert sunk == [0, 4]
+    assert pipeline.timings.as_dict()['drop']['dropped'] == 3
+    assert pipeline.timings.as_dict()['fail']['dropped'] == 1
+    # Every frame went back to the pool, whichever way it left
+    assert len(pool.free) == pool.allocated
+
+
+def test_tap_cannot_drop_or_replace_frames():
+    pool = FramePool()
+    seen = []
+    tap = Stage('tap', lambda frame: seen.append(frame.data['n']), tap=True)
+    failing_tap = Stage('broken', lambda frame: 1 / 0, tap=True)
+    _, sunk = run([tap, failing_tap], count=3, pool=pool)
+    assert seen == sunk == [0, 1, 2]
+    assert len(pool.free) == pool.allocated
+
+
+def test_threaded_stage_keeps_order():
+    pipeline, sunk = run([Stage('work', lambda frame: frame, threads=3, queue_size=8,
+                               drop_policy='block')], count=50)
+    pipeline.stop()
+    assert sunk == list(range(50))
+
+
+@pytest.mark.parametrize('policy, expected', [('drop_oldest', [0, 3]), ('drop_newest', [0, 1])])
+def test_full_queue_applies_drop_policy(policy, expected):
+    pool = FramePool()
+    started, proceed = threading.Event(), threading.Event()
+
+    def slow(frame):
+        started.set()
+        proceed.wait(5)
+        return frame
+
+    sunk = []
+    pipeline = Pipeline([Stage('slow', slow, threads=1, queue_size=1, drop_policy=policy)],
+                        sink=lambda frame: sunk.append(frame.data['n'])).start()
+    for n in range(4):
+        buffer = pool.acquire((2, 2))
+        frame = Frame(buffer.array, 'YUV420', float(n), buffer=buffer)
+        frame.data['n'] = n
+        pipeline.submit(frame)
+        if n == 0:
+            # The worker holds frame 0, so the queue fills from frame 1 on
+            assert started.wait(5)
+    proceed.set()
+    pipeline.stop()
+    assert sunk == expected
+    assert pipeline.timings.as_dict()['slow']['dropped'] == 2
+    assert len(pool.free) == pool.allocated
+
+
+def test_threaded_tap_releases_its_reference():
+    pool = FramePool()
+    pipeline, sunk = run([Stage('tap', lambda frame: None, threads=1, queue_size=4, tap=True)],
+                         count=3, pool=pool)
+    pipeline.stop()
+    assert sunk == [0, 1, 2]
+    assert len(pool.free) == pool.allocated
+
+
+def test_stage_names_are_unique():
+    pipeline = Pipeline([Stage('a')])
+    with pytest.raises(ValueError):
+        pipeline.add(Stage('a'))
+    with pytest.raises(ValueError):
+        pipeline.add(Stage('b'), before='missing')
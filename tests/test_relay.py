@@ -0,0 +1,35 @@
+"""Multipart streams are split into parts with and without Content-Length."""
+import io
+
+from picamera2_webstream.relay import parse_boundary, read_multipart
+
+
+def part(body, **headers):
+    lines = [b'--frame', b'Content-Type: image/jpeg']
+    lines += [f'{key.replace("_", "-")}: {value}'.encode() for key, value in headers.items()]
+    return b'\r\n'.join(lines) + b'\r\n\r\n' + body + b'\r\n'
+
+
+def test_parts_with_content_length():
+    body = b'\xff\xd8one\r\n--frame'
+    stream = io.BytesIO(part(body, Content_Length=len(body), X_Frame_Seq=7) +
+                        part(b'two', Content_Length=3))
+    parts = list(read_multipart(stream))
+    # The body is read by length, so boundary-like bytes inside it are kept
+    assert [data for _, data in parts] == [body, b'two']
+    assert parts[0][0]['x-frame-seq'] == '7'
+
+
+def test_parts_without_content_length_end_at_the_boundary():
+    stream = io.BytesIO(b'preamble\r\n' + part(b'first') + part(b'second') + b'--frame\r\n')
+    assert [body for _, body in read_multipart(stream)] == [b'first', b'second']
+
+
+def test_truncated_part_is_not_returned():
+    stream = io.BytesIO(part(b'whole', Content_Length=5) + part(b'cut', Content_Length=10)[:-4])
+    assert [body for _, body in read_multipart(stream)] == [b'whole']
+
+
+def test_boundary_from_content_type():
+    assert parse_boundary('multipart/x-mixed-replace; boundary="ffmpeg"') == b'ffmpeg'
+    assert parse_boundary('multipart/x-mixed-replace') == b'frame'
@@ -0,0 +1,46 @@
+"""ROI crops are cut from the raw planes and scaled to fit the requested size."""
+import numpy as np
+import pytest
+
+from picamera2_webstream.jpeg import yuv420_planes
+from picamera2_webstream.roi import crop_image, crop_yuv420, parse_roi, parse_size
+
+
+def yuv_frame(width=64, height=48):
+    frame = np.zeros((height * 3 // 2, width), np.uint8)
+    y, u, v = yuv420_planes(frame)
+    y[...] = np.arange(width)
+    u[...] = np.arange(height // 2)[:, None]
+    v[...] = 200
+    return frame
+
+
+def test_yuv420_crop_takes_matching_planes():
+    crop = crop_yuv420(yuv_frame(), (0.5, 0.5, 0.5, 0.5))
+    y, u, v = yuv420_planes(crop)
+    assert y.shape == (24, 32)
+    assert (y[0] == np.arange(32, 64)).all()
+    assert (u[:, 0] == np.arange(12, 24)).all()
+    assert (v == 200).all()
+
+
+def test_yuv420_crop_fits_size_and_keeps_aspect():
+    crop = crop_yuv420(yuv_frame(), (0, 0, 1, 1), size=(16, 100))
+    assert crop.shape == (12 * 3 // 2, 16)
+
+
+def test_crop_is_never_enlarged():
+    frame = np.zeros((48, 64, 3), np.uint8)
+    assert crop_image(frame, (0, 0, 0.25, 0.25), size=(640, 480)).shape == (12, 16, 3)
+
+
+@pytest.mark.parametrize('text', ['1', '0x10', 'axb', '10x'])
+def test_bad_sizes_are_rejected(text):
+    with pytest.raises(ValueError):
+        parse_size(text)
+
+
+@pytest.mark.parametrize('text', ['0,0,1.5,1', '0,0,0,1', '1,2,3'])
+def test_bad_rois_are_rejected(text):
+    with pytest.raises(ValueError):
+        parse_roi(text)